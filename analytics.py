@@ -0,0 +1,350 @@
+'''
+Columnar in-memory engine for grade statistics.
+
+GradeAnalytics loads the grades table into compact typed columns (int32 student and subject ids,
+int32 grades and day numbers) next to small lookup tables for students, groups, subjects and lecturers,
+and answers the average grade questions (1-4 and 8) with group-by over whole columns. The results are the
+same named tuples, with the same values and ties, as UniversityReports on the SQL path.
+
+NumPy is optional: when it is installed the group-by runs vectorized with bincount, otherwise
+the same columns are aggregated by plain loops over the arrays.
+'''
+from array import array
+from itertools import chain
+import math
+import sqlite3
+
+from database import ConnectionSettings, GroupAverage, StudentAverage, SubjectAverage, day_number
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+GRADE_VALUES = range(1, 7)
+
+# Grades with a date SQLite cannot parse get this day number.
+UNKNOWN_DAY = -1
+# Grades without a student or subject get this id; it is also the key of grades whose student has no group.
+NO_ID = 0
+
+
+class GradeColumns:
+    '''
+    Class holding the grades as typed columns. Rows with a NULL grade are left out,
+    because they do not take part in any of the aggregations. A NULL student or subject is stored as NO_ID,
+    which no row has, so as in the summary tables the grade still counts for its subject or its student.
+    '''
+    def __init__(self):
+        self.student_ids = array('i')
+        self.subject_ids = array('i')
+        self.grades = array('i')
+        self.days = array('i')
+        self.max_student_id = 0
+        self.max_subject_id = 0
+        self.min_grade = GRADE_VALUES[0]
+        self.max_grade = GRADE_VALUES[-1]
+
+    def __len__(self):
+        return len(self.grades)
+
+    def append(self, student_id, subject_id, grade, day):
+        student_id = NO_ID if student_id is None else student_id
+        subject_id = NO_ID if subject_id is None else subject_id
+        columns = (self.student_ids, self.subject_ids, self.grades, self.days)
+        length = len(self.grades)
+        try:
+            for column, value in zip(columns, (student_id, subject_id, grade, day)):
+                column.append(value)
+        except (OverflowError, TypeError):
+            # Every column is cut back, so a row that does not fit leaves all the columns as they were.
+            for column in columns:
+                del column[length:]
+            raise ValueError(f"Grade row {(student_id, subject_id, grade, day)!r} does not fit in 32-bit integers.") from None
+        self.min_grade = min(self.min_grade, grade)
+        self.max_grade = max(self.max_grade, grade)
+        self.max_student_id = max(self.max_student_id, student_id)
+        self.max_subject_id = max(self.max_subject_id, subject_id)
+
+
+def as_numpy(column):
+    if isinstance(column, array):
+        return numpy.frombuffer(column, dtype=numpy.int32)
+    return column
+
+
+def grouped_sums(keys, values, size):
+    '''
+    Returns the lists of sums and counts of values per key, for keys in range(size).
+    '''
+    if numpy is not None:
+        keys = as_numpy(keys)
+        values = as_numpy(values)
+        counts = numpy.bincount(keys, minlength=size)
+        # float64 weights are exact for sums below 2**53, so converting back to int loses nothing.
+        sums = numpy.bincount(keys, weights=values, minlength=size)
+        return [int(total) for total in sums], counts.tolist()
+    sums = [0] * size
+    counts = [0] * size
+    for key, value in zip(keys, values):
+        sums[key] += value
+        counts[key] += 1
+    return sums, counts
+
+
+class GradeAnalytics:
+    '''
+    Class for computing grade statistics in memory. Takes the database name as an argument.
+    load() reads the whole grades table, refresh() appends the grades added since the last load and
+    append() adds grades that are known to the caller without reading them back. Updated or deleted grades
+    and changed students are only picked up by load().
+    '''
+    def __init__(self, db_name, settings=None):
+        self.db_name = db_name
+        self.settings = settings if settings is not None else ConnectionSettings()
+        self.columns = GradeColumns()
+        self.last_grade_id = 0
+        self.student_names = {}
+        self.student_groups = {}
+        self.group_names = {}
+        self.subjects = {}
+        self.lecturer_names = {}
+
+    def connect(self):
+        return self.settings.configure_reader(sqlite3.connect(self.db_name))
+
+    def load(self):
+        self.columns = GradeColumns()
+        self.last_grade_id = 0
+        return self.refresh()
+
+    def refresh(self, batch_size=100000):
+        conn = self.connect()
+        try:
+            self.load_lookup_tables(conn)
+            cursor = conn.execute('''SELECT id, student_id, subject_id, grade,
+                                            IFNULL(CAST(julianday(date) - 2440587.5 AS INTEGER), ?)
+                                     FROM grades
+                                     WHERE id > ?
+                                     ORDER BY id''', (UNKNOWN_DAY, self.last_grade_id))
+            appended = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for grade_id, student_id, subject_id, grade, day in rows:
+                    if grade is not None:
+                        self.columns.append(student_id, subject_id, grade, day)
+                        appended += 1
+                    # Advanced row by row, so a grade that cannot be loaded is not appended twice by the next refresh.
+                    self.last_grade_id = grade_id
+        finally:
+            conn.close()
+        return appended
+
+    def load_lookup_tables(self, conn):
+        self.student_names = {}
+        self.student_groups = {}
+        for student_id, name, group_id in conn.execute("SELECT id, name, group_id FROM students"):
+            self.student_names[student_id] = name
+            self.student_groups[student_id] = group_id
+        self.group_names = dict(conn.execute("SELECT id, name FROM groups"))
+        self.subjects = {subject_id: (name, lecturer_id)
+                         for subject_id, name, lecturer_id in conn.execute("SELECT id, name, lecturer_id FROM subjects")}
+        self.lecturer_names = dict(conn.execute("SELECT id, name FROM lecturers"))
+
+    def append(self, grades):
+        '''
+        Appends (grade_id, student_id, subject_id, grade, date) rows of grades that were just inserted.
+        '''
+        for grade_id, student_id, subject_id, grade, date in grades:
+            if grade is not None:
+                self.columns.append(student_id, subject_id, grade, grade_day(date))
+            self.last_grade_id = max(self.last_grade_id, grade_id)
+
+    def key_size(self, ids, column_max=0):
+        return max(max(ids, default=0), column_max) + 1
+
+    def subject_ids(self, subject):
+        subject_ids = [subject_id for subject_id, (name, _) in self.subjects.items() if name == subject]
+        if not subject_ids:
+            raise LookupError("There is no such subject.")
+        return subject_ids
+
+    def selected(self, subject_ids):
+        '''
+        Returns the student id and grade columns restricted to the grades of the given subjects.
+        '''
+        if numpy is not None:
+            mask = numpy.isin(as_numpy(self.columns.subject_ids), subject_ids)
+            return as_numpy(self.columns.student_ids)[mask], as_numpy(self.columns.grades)[mask]
+        subject_ids = set(subject_ids)
+        student_ids = array('i')
+        grades = array('i')
+        for student_id, subject_id, grade in zip(self.columns.student_ids, self.columns.subject_ids, self.columns.grades):
+            if subject_id in subject_ids:
+                student_ids.append(student_id)
+                grades.append(grade)
+        return student_ids, grades
+
+    def student_totals(self, student_ids, grades):
+        size = self.key_size(self.student_names, self.columns.max_student_id)
+        sums, counts = grouped_sums(student_ids, grades, size)
+        return {student_id: (sums[student_id], counts[student_id])
+                for student_id in self.student_names if counts[student_id]}
+
+    def group_totals(self, student_ids, grades):
+        totals = {}
+        student_sums = self.student_totals(student_ids, grades)
+        for student_id, (grade_sum, grade_count) in student_sums.items():
+            group_id = self.student_groups[student_id]
+            if group_id in self.group_names:
+                group_sum, group_count = totals.get(group_id, (0, 0))
+                totals[group_id] = (group_sum + grade_sum, group_count + grade_count)
+        return totals
+
+    def ranked(self, totals, last_position):
+        averages = sorted(((grade_sum / grade_count, student_id) for student_id, (grade_sum, grade_count) in totals.items()),
+                          key=lambda average: (-average[0], average[1]))
+        result = []
+        position = 0
+        for index, (average_grade, student_id) in enumerate(averages):
+            if index == 0 or average_grade != averages[index - 1][0]:
+                position = index + 1
+            if position > last_position:
+                break
+            result.append(StudentAverage(position, student_id, self.student_names[student_id], average_grade))
+        return result
+
+    def top_students(self):
+        totals = self.student_totals(self.columns.student_ids, self.columns.grades)
+        return self.ranked(totals, 5)
+
+    def best_students_in_subject(self, subject):
+        totals = self.student_totals(*self.selected(self.subject_ids(subject)))
+        return self.ranked(totals, 1)
+
+    def group_averages_in_subject(self, subject):
+        totals = self.group_totals(*self.selected(self.subject_ids(subject)))
+        return [GroupAverage(group_id, self.group_names[group_id], grade_sum / grade_count)
+                for group_id, (grade_sum, grade_count) in sorted(totals.items())]
+
+    def group_averages(self):
+        totals = self.group_totals(self.columns.student_ids, self.columns.grades)
+        return [GroupAverage(group_id, self.group_names[group_id], grade_sum / grade_count)
+                for group_id, (grade_sum, grade_count) in sorted(totals.items())]
+
+    def lecturer_subject_averages(self, lecturer, subject):
+        lecturer_ids = [lecturer_id for lecturer_id, name in self.lecturer_names.items() if name == lecturer]
+        if not lecturer_ids:
+            raise LookupError("There is no such lecturer.")
+        subject_ids = [subject_id for subject_id in self.subject_ids(subject) if self.subjects[subject_id][1] in lecturer_ids]
+        if not subject_ids:
+            raise LookupError(f"Lecturer {lecturer} does not teach {subject}.")
+        sums, counts = grouped_sums(self.columns.subject_ids, self.columns.grades,
+                                    self.key_size(self.subjects, self.columns.max_subject_id))
+        return [SubjectAverage(subject_id, self.subjects[subject_id][0], sums[subject_id] / counts[subject_id])
+                for subject_id in sorted(subject_ids) if counts[subject_id]]
+
+    def dimension_keys(self, dimension):
+        '''
+        Returns the key column and the key names for grouping the grades by student, group, subject or lecturer.
+        Grades whose student or subject has no group or lecturer get the key 0.
+        '''
+        if dimension == 'student':
+            return self.columns.student_ids, self.student_names
+        if dimension == 'subject':
+            return self.columns.subject_ids, {subject_id: name for subject_id, (name, _) in self.subjects.items()}
+        if dimension == 'group':
+            lookup = self.lookup(self.student_groups, self.columns.max_student_id)
+            return self.translated(self.columns.student_ids, lookup), self.group_names
+        if dimension == 'lecturer':
+            lookup = self.lookup({subject_id: lecturer_id for subject_id, (_, lecturer_id) in self.subjects.items()},
+                                 self.columns.max_subject_id)
+            return self.translated(self.columns.subject_ids, lookup), self.lecturer_names
+        raise ValueError(f"Unknown dimension {dimension!r}, expected student, group, subject or lecturer.")
+
+    def lookup(self, mapping, column_max):
+        lookup = array('i', [0]) * self.key_size(mapping, column_max)
+        for key, value in mapping.items():
+            lookup[key] = value or 0
+        return lookup
+
+    def translated(self, column, lookup):
+        if numpy is not None:
+            return as_numpy(lookup)[as_numpy(column)]
+        return array('i', (lookup[key] for key in column))
+
+    def has_other_grades(self):
+        return self.columns.min_grade < GRADE_VALUES[0] or self.columns.max_grade > GRADE_VALUES[-1]
+
+    def grade_distribution(self, dimension):
+        '''
+        Returns {key: [number of 1s, number of 2s, ..., number of 6s, number of other grades]} for every key
+        of the dimension that has grades. Grades outside 1-6 all share the last slot.
+        '''
+        keys, names = self.dimension_keys(dimension)
+        size = self.key_size(names, max(self.columns.max_student_id, self.columns.max_subject_id))
+        # Every (key, grade) pair gets its own slot, so one pass counts all grade values at once.
+        lowest = GRADE_VALUES[0]
+        slots = len(GRADE_VALUES) + 1
+        if numpy is not None:
+            grades = as_numpy(self.columns.grades)
+            inside = (grades >= lowest) & (grades <= GRADE_VALUES[-1])
+            combined = as_numpy(keys).astype(numpy.int64) * slots + numpy.where(inside, grades - lowest, slots - 1)
+            counts = numpy.bincount(combined, minlength=size * slots).tolist()
+        else:
+            counts = [0] * (size * slots)
+            for key, grade in zip(keys, self.columns.grades):
+                counts[key * slots + (grade - lowest if grade in GRADE_VALUES else slots - 1)] += 1
+        distribution = {}
+        for key in names:
+            key_counts = counts[key * slots:(key + 1) * slots]
+            if any(key_counts):
+                distribution[key] = key_counts
+        return distribution
+
+    def grade_percentile(self, dimension, fraction):
+        '''
+        Returns {key: grade} with the nearest-rank percentile of the grades of every key of the dimension.
+        '''
+        other_grades = self.other_grades(dimension) if self.has_other_grades() else {}
+        percentiles = {}
+        for key, counts in self.grade_distribution(dimension).items():
+            rank = max(1, math.ceil(fraction * sum(counts)))
+            below = [grade for grade in other_grades.get(key, ()) if grade < GRADE_VALUES[0]]
+            above = [grade for grade in other_grades.get(key, ()) if grade > GRADE_VALUES[-1]]
+            seen = 0
+            for grade, count in chain(((grade, 1) for grade in below), zip(GRADE_VALUES, counts),
+                                      ((grade, 1) for grade in above)):
+                seen += count
+                if seen >= rank:
+                    percentiles[key] = grade
+                    break
+        return percentiles
+
+    def other_grades(self, dimension):
+        '''
+        Returns {key: sorted grades outside 1-6} for every key of the dimension that has such grades.
+        '''
+        keys, _ = self.dimension_keys(dimension)
+        if numpy is not None:
+            grades = as_numpy(self.columns.grades)
+            outside = (grades < GRADE_VALUES[0]) | (grades > GRADE_VALUES[-1])
+            pairs = zip(as_numpy(keys)[outside].tolist(), grades[outside].tolist())
+        else:
+            pairs = ((key, grade) for key, grade in zip(keys, self.columns.grades) if grade not in GRADE_VALUES)
+        other_grades = {}
+        for key, grade in pairs:
+            other_grades.setdefault(key, []).append(grade)
+        for grades in other_grades.values():
+            grades.sort()
+        return other_grades
+
+
+def grade_day(date):
+    try:
+        return day_number(str(date))
+    except ValueError:
+        return UNKNOWN_DAY
@@ -0,0 +1,168 @@
+'''
+Benchmark for the ten report queries at several data scales.
+
+Seeds one database per scale with a fixed seed (reused and migrated on later runs), runs every query with
+representative parameters through QueryExecutor and writes p50/p95/p99 latency, rows returned
+and peak Python memory per query as JSON. Passing --compare with an earlier result reports the
+queries whose p95 latency got worse by more than --threshold.
+
+    python benchmark.py --scales 1k 100k --output bench.json
+    python benchmark.py --scales 1k 100k --compare bench.json
+'''
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+from database import CreateConnection, DatabaseInitializer, FakeDataGenerator, QueryExecutor, SchemaMigrator, ids_parameter
+
+
+SCALES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '10m': 10_000_000,
+}
+
+# Expected number of grades per student with the default FakeDataGenerator settings.
+GRADES_PER_STUDENT = 15
+
+
+def percentile(sorted_values, fraction):
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def seed_database(db_name, grades, seed):
+    if os.path.exists(db_name):
+        with CreateConnection(db_name) as connection:
+            SchemaMigrator(connection).migrate()
+        return None
+    generator = FakeDataGenerator(num_students=max(1, grades // GRADES_PER_STUDENT), seed=seed)
+    start_time = time.perf_counter()
+    DatabaseInitializer(db_name).initialize_database(bulk=True, generator=generator)
+    return time.perf_counter() - start_time
+
+
+def representative_parameters(query_executor):
+    '''
+    Picks what the parameterised questions are asked about: the first group and subject,
+    the lecturer of that subject and the student with the most grades.
+    '''
+    group_id = query_executor.run('benchmark', "SELECT id FROM groups ORDER BY id LIMIT 1", None, lambda cur: cur.fetchone()[0])
+    subject_id, lecturer_id = query_executor.run('benchmark', "SELECT id, lecturer_id FROM subjects ORDER BY id LIMIT 1",
+                                                 None, lambda cur: cur.fetchone())
+    student = query_executor.run('benchmark', """
+        SELECT students.name
+        FROM grades
+        JOIN students ON grades.student_id = students.id
+        GROUP BY grades.student_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """, None, lambda cur: cur.fetchone()[0])
+    group_ids, subject_ids, lecturer_ids = ids_parameter([group_id]), ids_parameter([subject_id]), ids_parameter([lecturer_id])
+    return {
+        'query_1.sql': None,
+        'query_2.sql': (subject_ids,),
+        'query_3.sql': (subject_ids,),
+        'query_4.sql': None,
+        'query_5.sql': (lecturer_ids,),
+        'query_6.sql': (group_ids,),
+        'query_7.sql': (group_ids, subject_ids),
+        'query_8.sql': (subject_ids,),
+        'query_9.sql': (student,),
+        'query_10.sql': (lecturer_ids, student),
+    }
+
+
+def benchmark_query(query_executor, query_file, parameters, iterations):
+    query_executor.execute_sql_query(query_file, parameters)
+    latencies = []
+    for _ in range(iterations):
+        rows = query_executor.execute_sql_query(query_file, parameters)
+        latencies.append(query_executor.last_latency)
+    latencies.sort()
+
+    # Memory is traced in a separate, untimed run, so the tracing overhead does not show in the latencies.
+    tracemalloc.start()
+    query_executor.execute_sql_query(query_file, parameters)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'parameters': parameters,
+        'iterations': iterations,
+        'rows': len(rows),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def benchmark_scale(db_name, grades, seed, iterations):
+    seed_seconds = seed_database(db_name, grades, seed)
+    with QueryExecutor(db_name, pool_size=1, cache_max_bytes=0) as query_executor:
+        grade_count = query_executor.run('benchmark', "SELECT COUNT(*) FROM grades", None, lambda cur: cur.fetchone()[0])
+        queries = {query_file: benchmark_query(query_executor, query_file, parameters, iterations)
+                   for query_file, parameters in representative_parameters(query_executor).items()}
+    return {
+        'database': db_name,
+        'grades': grade_count,
+        'seed_seconds': seed_seconds,
+        'queries': queries,
+    }
+
+
+def compare(results, baseline, threshold):
+    '''
+    Returns (scale, query, baseline p95, current p95) for every query whose p95 latency grew by more than threshold.
+    '''
+    regressions = []
+    for scale, scale_results in results['scales'].items():
+        baseline_queries = baseline.get('scales', {}).get(scale, {}).get('queries', {})
+        for query_file, stats in scale_results['queries'].items():
+            if query_file not in baseline_queries:
+                continue
+            before = baseline_queries[query_file]['p95_ms']
+            if stats['p95_ms'] > before * (1 + threshold):
+                regressions.append((scale, query_file, before, stats['p95_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the report queries at several data scales.")
+    parser.add_argument('--scales', nargs='+', default=['1k', '100k'], choices=SCALES)
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--data-dir', default='bench_data')
+    parser.add_argument('--output', help="file to write the JSON results to (stdout by default)")
+    parser.add_argument('--compare', help="earlier JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative p95 slowdown")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {'seed': args.seed, 'iterations': args.iterations, 'scales': {}}
+    for scale in args.scales:
+        db_name = os.path.join(args.data_dir, f"university_{scale}_{args.seed}.db")
+        results['scales'][scale] = benchmark_scale(db_name, SCALES[scale], args.seed, args.iterations)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for scale, query_file, before, after in regressions:
+            print(f"Regression at {scale}: {query_file} p95 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,66 @@
-from faker import Faker
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import argparse
+import csv
+import datetime
+import json
+import queue
 import random
 import sqlite3
+import sys
+import threading
+import time
 import os
+from typing import NamedTuple
 
-fake = Faker()
+# Faker, multiprocessing, asyncio, concurrent.futures, logging, gzip and shutil are imported where they are used,
+# so a reporting run on an existing database does not pay for loading them.
+
+
+class ConnectionSettings:
+    '''
+    Class for configuring database connections. Writers switch the database to WAL mode, so readers are not blocked
+    by a running import, and readers additionally memory-map the file. Every connection waits busy_timeout milliseconds
+    for a lock instead of failing at once. checkpoint() moves the WAL back into the database at most every
+    checkpoint_interval seconds, on top of SQLite's own automatic checkpoints.
+    '''
+    def __init__(self, journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000, mmap_size=256 * 1024 * 1024,
+                 wal_autocheckpoint=1000, checkpoint_interval=10.0):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+
+    def configure_writer(self, conn):
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {self.wal_autocheckpoint}")
+        return conn
+
+    def configure_reader(self, conn):
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        return conn
+
+    def checkpoint(self, conn, mode='PASSIVE', force=False):
+        if not force and time.monotonic() - self.last_checkpoint < self.checkpoint_interval:
+            return None
+        self.last_checkpoint = time.monotonic()
+        return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
 
 
 class CreateConnection:
     '''
-    Class for creating a database connection. Takes the database name as an argument.
+    Class for creating a database connection. Takes the database name and optionally the ConnectionSettings as arguments.
     The connection is opened when the object is created.
     '''
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name, settings=None):
+        self.settings = settings if settings is not None else ConnectionSettings()
+        self.conn = self.settings.configure_writer(sqlite3.connect(db_name))
         self.cur = self.conn.cursor()
 
     def close_connection(self):
@@ -29,6 +77,41 @@ class CreateConnection:
         self.conn.close()
 
 
+class BulkLoadSettings:
+    '''
+    Context manager for tuning the database for a bulk load. Takes a connection object as an argument.
+    On enter it switches journal_mode, synchronous and cache_size to fast loading values,
+    on exit it restores the values that were set before.
+    '''
+    LOAD_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+    }
+
+    def __init__(self, connection, pragmas=None):
+        self.conn = connection
+        self.cur = connection.cur
+        self.pragmas = pragmas if pragmas is not None else self.LOAD_PRAGMAS
+        self.saved = {}
+
+    def __enter__(self):
+        # journal_mode cannot be changed inside an open transaction.
+        self.conn.conn.commit()
+        for name, value in self.pragmas.items():
+            self.saved[name] = self.cur.execute(f"PRAGMA {name}").fetchone()[0]
+            self.cur.execute(f"PRAGMA {name} = {value}")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.conn.conn.rollback()
+        else:
+            self.conn.conn.commit()
+        for name, value in self.saved.items():
+            self.cur.execute(f"PRAGMA {name} = {value}")
+
+
 class CreateTables:
     '''
     Class for creating tables in the database. Takes a connection object as an argument.
@@ -64,6 +147,220 @@ class CreateTables:
                             FOREIGN KEY (subject_id) REFERENCES subjects(id))''')
 
 
+# Summary tables of grade sums and counts, kept up to date by triggers.
+# Every entry is (table, key columns, key expressions for a grades row r).
+GRADE_TOTALS = [
+    ('student_grade_totals', ['student_id'], ['{r}.student_id']),
+    ('student_subject_grade_totals', ['subject_id', 'student_id'], ['{r}.subject_id', '{r}.student_id']),
+    ('subject_grade_totals', ['subject_id'], ['{r}.subject_id']),
+    ('group_grade_totals', ['group_id'], ['students.group_id']),
+    ('group_subject_grade_totals', ['subject_id', 'group_id'], ['{r}.subject_id', 'students.group_id']),
+]
+
+
+def not_null_keys(expressions, r):
+    # The summary table keys are a primary key and cannot be NULL, while grades.student_id and subject_id can.
+    return " AND ".join(f"{e.format(r=r)} IS NOT NULL" for e in expressions if e.startswith('{r}')) or "true"
+
+
+def grade_totals_statements():
+    '''
+    Returns the statements creating, backfilling and maintaining the grade summary tables.
+    '''
+    statements = []
+    for table, columns, expressions in GRADE_TOTALS:
+        keys = ", ".join(columns)
+        by_group = 'students.group_id' in expressions
+        statements.append(f'''CREATE TABLE IF NOT EXISTS {table} (
+                                {" INTEGER, ".join(columns)} INTEGER,
+                                grade_sum INTEGER NOT NULL,
+                                grade_count INTEGER NOT NULL,
+                                PRIMARY KEY ({keys})) WITHOUT ROWID''')
+
+        grades_keys = ", ".join(e.format(r='grades') for e in expressions)
+        join = "JOIN students ON students.id = grades.student_id AND students.group_id IS NOT NULL" if by_group else ""
+        statements.append(f'''INSERT INTO {table} ({keys}, grade_sum, grade_count)
+                              SELECT {grades_keys}, SUM(grades.grade), COUNT(grades.grade)
+                              FROM grades {join}
+                              WHERE grades.grade IS NOT NULL AND {not_null_keys(expressions, 'grades')}
+                              GROUP BY {grades_keys}''')
+    return statements + grade_triggers_statements() + student_triggers_statements()
+
+
+def grade_triggers_statements():
+    '''
+    Returns the statements creating the triggers that keep the summary tables up to date with the grades.
+    '''
+    add_grade = []
+    remove_grade = []
+    for table, columns, expressions in GRADE_TOTALS:
+        keys = ", ".join(columns)
+        by_group = 'students.group_id' in expressions
+        source = "FROM students WHERE students.id = {r}.student_id AND students.group_id IS NOT NULL AND " if by_group else "WHERE "
+        add_grade.append(f'''INSERT INTO {table} ({keys}, grade_sum, grade_count)
+                             SELECT {", ".join(e.format(r='NEW') for e in expressions)}, NEW.grade, 1
+                             {source.format(r='NEW')}{not_null_keys(expressions, 'NEW')}
+                             ON CONFLICT ({keys}) DO UPDATE SET grade_sum = grade_sum + excluded.grade_sum,
+                                                              grade_count = grade_count + excluded.grade_count;''')
+        remove_grade.append(f'''UPDATE {table} SET grade_sum = grade_sum - OLD.grade, grade_count = grade_count - 1
+                                WHERE ({keys}) = (SELECT {", ".join(e.format(r='OLD') for e in expressions)}
+                                                  {source.format(r='OLD')}{not_null_keys(expressions, 'OLD')});''')
+
+    add_grade = "\n".join(add_grade)
+    remove_grade = "\n".join(remove_grade)
+    return [
+        f"CREATE TRIGGER grades_insert_totals AFTER INSERT ON grades WHEN NEW.grade IS NOT NULL BEGIN {add_grade} END",
+        f"CREATE TRIGGER grades_delete_totals AFTER DELETE ON grades WHEN OLD.grade IS NOT NULL BEGIN {remove_grade} END",
+        f'''CREATE TRIGGER grades_update_remove_totals AFTER UPDATE OF student_id, subject_id, grade ON grades
+            WHEN OLD.grade IS NOT NULL BEGIN {remove_grade} END''',
+        f'''CREATE TRIGGER grades_update_add_totals AFTER UPDATE OF student_id, subject_id, grade ON grades
+            WHEN NEW.grade IS NOT NULL BEGIN {add_grade} END''',
+    ]
+
+
+def student_triggers_statements():
+    '''
+    Returns the statements creating the triggers that move the group totals with students that join, leave or change their group.
+    '''
+    statements = []
+    statements.append("CREATE INDEX IF NOT EXISTS idx_student_subject_grade_totals_student_id "
+                      "ON student_subject_grade_totals (student_id)")
+    add_student = '''INSERT INTO group_grade_totals (group_id, grade_sum, grade_count)
+                     SELECT NEW.group_id, grade_sum, grade_count FROM student_grade_totals
+                     WHERE student_id = NEW.id AND NEW.group_id IS NOT NULL
+                     ON CONFLICT (group_id) DO UPDATE SET grade_sum = grade_sum + excluded.grade_sum,
+                                                         grade_count = grade_count + excluded.grade_count;
+                     INSERT INTO group_subject_grade_totals (subject_id, group_id, grade_sum, grade_count)
+                     SELECT subject_id, NEW.group_id, grade_sum, grade_count FROM student_subject_grade_totals
+                     WHERE student_id = NEW.id AND NEW.group_id IS NOT NULL
+                     ON CONFLICT (subject_id, group_id) DO UPDATE SET grade_sum = grade_sum + excluded.grade_sum,
+                                                                     grade_count = grade_count + excluded.grade_count;'''
+    remove_student = '''UPDATE group_grade_totals
+                        SET grade_sum = grade_sum - (SELECT grade_sum FROM student_grade_totals WHERE student_id = OLD.id),
+                            grade_count = grade_count - (SELECT grade_count FROM student_grade_totals WHERE student_id = OLD.id)
+                        WHERE group_id = OLD.group_id
+                        AND EXISTS (SELECT 1 FROM student_grade_totals WHERE student_id = OLD.id);
+                        UPDATE group_subject_grade_totals
+                        SET grade_sum = grade_sum - (SELECT s.grade_sum FROM student_subject_grade_totals s
+                                                     WHERE s.student_id = OLD.id AND s.subject_id = group_subject_grade_totals.subject_id),
+                            grade_count = grade_count - (SELECT s.grade_count FROM student_subject_grade_totals s
+                                                         WHERE s.student_id = OLD.id AND s.subject_id = group_subject_grade_totals.subject_id)
+                        WHERE group_id = OLD.group_id
+                        AND subject_id IN (SELECT subject_id FROM student_subject_grade_totals WHERE student_id = OLD.id);'''
+    statements += [
+        f"CREATE TRIGGER students_insert_totals AFTER INSERT ON students BEGIN {add_student} END",
+        f"CREATE TRIGGER students_delete_totals AFTER DELETE ON students BEGIN {remove_student} END",
+        f'''CREATE TRIGGER students_update_totals AFTER UPDATE OF id, group_id ON students
+            BEGIN {remove_student} {add_student} END''',
+    ]
+    return statements
+
+
+# Dates are also stored as day numbers (days since 1970-01-01), so a date range is an integer range on an index.
+DAY_EXPRESSION = "CAST(julianday(date) - 2440587.5 AS INTEGER)"
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def day_number(date):
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return (date - EPOCH).days
+
+
+def day_bounds(since=None, until=None):
+    # Both ends are inclusive; a missing end leaves the range open on that side.
+    first_day = day_number(since if since is not None else datetime.date.min)
+    last_day = day_number(until if until is not None else datetime.date.max)
+    return first_day, last_day
+
+
+def archive_statements(schema):
+    '''
+    Returns the statements creating the grades table of an archive database attached as schema.
+    '''
+    return [
+        f'''CREATE TABLE IF NOT EXISTS {schema}.grades (
+               id INTEGER PRIMARY KEY,
+               student_id INTEGER,
+               subject_id INTEGER,
+               grade INTEGER,
+               date TEXT,
+               day INTEGER GENERATED ALWAYS AS ({DAY_EXPRESSION}) VIRTUAL)''',
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_grades_day ON grades (day, subject_id, student_id, grade)",
+    ]
+
+
+def archive_schema(period):
+    return f"archive_{period}"
+
+
+class SchemaMigrator:
+    '''
+    Class for applying versioned schema migrations. Takes a connection object as an argument.
+    The version of the schema is kept in PRAGMA user_version; migrate() applies every migration newer than it,
+    each in its own transaction, so it can be run on an existing database without reseeding.
+    '''
+    MIGRATIONS = [
+        (1, "Indexes for name lookups and grade joins", [
+            "CREATE INDEX IF NOT EXISTS idx_students_name ON students (name)",
+            "CREATE INDEX IF NOT EXISTS idx_students_group_id ON students (group_id)",
+            "CREATE INDEX IF NOT EXISTS idx_groups_name ON groups (name)",
+            "CREATE INDEX IF NOT EXISTS idx_lecturers_name ON lecturers (name)",
+            "CREATE INDEX IF NOT EXISTS idx_subjects_name ON subjects (name)",
+            "CREATE INDEX IF NOT EXISTS idx_subjects_lecturer_id ON subjects (lecturer_id, name)",
+            "CREATE INDEX IF NOT EXISTS idx_grades_student_subject ON grades (student_id, subject_id, grade)",
+            "CREATE INDEX IF NOT EXISTS idx_grades_subject_student ON grades (subject_id, student_id, grade)",
+            "ANALYZE",
+        ]),
+        (2, "Grade summary tables for the average grade reports", grade_totals_statements() + ["ANALYZE"]),
+        (3, "Day numbers and archives for the time-range reports", [
+            f"ALTER TABLE grades ADD COLUMN day INTEGER GENERATED ALWAYS AS ({DAY_EXPRESSION}) VIRTUAL",
+            "CREATE INDEX IF NOT EXISTS idx_grades_day ON grades (day, subject_id, student_id, grade)",
+            '''CREATE TABLE IF NOT EXISTS grade_archives (
+               period TEXT PRIMARY KEY,
+               path TEXT NOT NULL,
+               first_day INTEGER,
+               last_day INTEGER,
+               grade_count INTEGER NOT NULL)''',
+            "ANALYZE",
+        ]),
+        (4, "Grade summary triggers that skip grades without a student or subject",
+         [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in ('grades_insert_totals', 'grades_delete_totals',
+                                                                 'grades_update_remove_totals', 'grades_update_add_totals')]
+         + grade_triggers_statements()),
+    ]
+
+    def __init__(self, connection):
+        self.conn = connection
+        self.cur = connection.cur
+
+    def current_version(self):
+        self.cur.execute("PRAGMA user_version")
+        return self.cur.fetchone()[0]
+
+    def latest_version(self):
+        return self.MIGRATIONS[-1][0]
+
+    def migrate(self, target_version=None):
+        target_version = self.latest_version() if target_version is None else target_version
+        applied = []
+        self.conn.conn.commit()
+        for version, description, statements in self.MIGRATIONS:
+            if version <= self.current_version() or version > target_version:
+                continue
+            try:
+                self.cur.execute("BEGIN")
+                for statement in statements:
+                    self.cur.execute(statement)
+                self.cur.execute(f"PRAGMA user_version = {version}")
+                self.conn.conn.commit()
+            except sqlite3.Error:
+                self.conn.conn.rollback()
+                raise
+            applied.append((version, description))
+        return applied
+
+
 class GroupData:
     '''
     Class for inserting data into the groups table. Takes a connection object as an argument.
@@ -78,6 +375,9 @@ class GroupData:
         self.conn.conn.commit()
         return self.cur.lastrowid
 
+    def insert_many(self, rows):
+        self.cur.executemany("INSERT INTO groups (id, name) VALUES (?, ?)", rows)
+
 
 class StudentData:
     '''
@@ -93,6 +393,9 @@ class StudentData:
         self.conn.conn.commit()
         return self.cur.lastrowid
 
+    def insert_many(self, rows):
+        self.cur.executemany("INSERT INTO students (id, name, group_id) VALUES (?, ?, ?)", rows)
+
 
 class LecturerData:
     '''
@@ -108,6 +411,9 @@ class LecturerData:
         self.conn.conn.commit()
         return self.cur.lastrowid
 
+    def insert_many(self, rows):
+        self.cur.executemany("INSERT INTO lecturers (id, name) VALUES (?, ?)", rows)
+
 
 class SubjectData:
     '''
@@ -123,6 +429,9 @@ class SubjectData:
         self.conn.conn.commit()
         return self.cur.lastrowid
 
+    def insert_many(self, rows):
+        self.cur.executemany("INSERT INTO subjects (id, name, lecturer_id) VALUES (?, ?, ?)", rows)
+
 
 class GradeData:
     '''
@@ -137,52 +446,179 @@ class GradeData:
         self.cur.execute("INSERT INTO grades (student_id, subject_id, grade, date) VALUES (?, ?, ?, ?)", (student_id, subject_id, grade, date))
         self.conn.conn.commit()
 
+    def insert_many(self, rows):
+        self.cur.executemany("INSERT INTO grades (student_id, subject_id, grade, date) VALUES (?, ?, ?, ?)", rows)
+
 
 class FakeDataGenerator:
     '''
     Class for generating fake data. Uses the Faker library to create fake data for groups, lecturers, subjects, students, and grades.
-    Provides a method to generate fake data.
+    The number of entities of each kind is configurable and the output is reproducible for a given seed.
+    Students and their grades are yielded in batches of bounded size, so memory use does not depend on the amount of data.
     '''
-    def __init__(self):
+    GROUP_NAMES = ['Group A', 'Group B', 'Group C']
+    SUBJECT_NAMES = ['Mathematics', 'Physics', 'Chemistry', 'Biology', 'History', 'English']
+
+    def __init__(self, num_groups=3, num_lecturers=5, num_subjects=6, num_students=40,
+                 grades_per_student=(10, 20), seed=None, batch_size=10000):
+        self.config = {
+            'num_groups': num_groups,
+            'num_lecturers': num_lecturers,
+            'num_subjects': num_subjects,
+            'num_students': num_students,
+            'grades_per_student': grades_per_student,
+            'seed': seed,
+            'batch_size': batch_size,
+        }
+        from faker import Faker
         self.fake = Faker()
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.num_groups = num_groups
+        self.num_lecturers = num_lecturers
+        self.num_subjects = num_subjects
+        self.num_students = num_students
+        self.grades_per_student = grades_per_student
+        self.batch_size = batch_size
+
+        today = datetime.date.today()
+        first_day = datetime.date(today.year, 1, 1)
+        self.dates = [(first_day + datetime.timedelta(days=i)).strftime('%Y-%m-%d')
+                      for i in range((today - first_day).days + 1)]
+
+    def reseed(self, key):
+        # Every batch gets its own seed, so a batch comes out the same no matter which process generates it.
+        if self.seed is not None:
+            self.random.seed(f"{self.seed}:{key}")
+            self.fake.seed_instance(f"{self.seed}:{key}")
+
+    def group_names(self):
+        return [self.GROUP_NAMES[i] if i < len(self.GROUP_NAMES) else f"Group {i + 1}"
+                for i in range(self.num_groups)]
+
+    def lecturer_names(self):
+        self.reseed('lecturers')
+        return [self.fake.name() for _ in range(self.num_lecturers)]
+
+    def subject_names(self):
+        return [self.SUBJECT_NAMES[i] if i < len(self.SUBJECT_NAMES) else f"Subject {i + 1}"
+                for i in range(self.num_subjects)]
+
+    def students_per_batch(self):
+        max_grades = max(self.grades_per_student[1], 2 * self.num_subjects)
+        return max(1, self.batch_size // max_grades)
+
+    def student_grades(self, student_index):
+        grades = []
+        for subject_index in range(self.num_subjects):
+            for _ in range(2):
+                grades.append((student_index, subject_index, self.random.randint(1, 6), self.random.choice(self.dates)))
+        additional_grades_count = self.random.randint(*self.grades_per_student) - len(grades)
+        for _ in range(additional_grades_count):
+            subject_index = self.random.randrange(self.num_subjects)
+            grades.append((student_index, subject_index, self.random.randint(1, 6), self.random.choice(self.dates)))
+        return grades
+
+    def batch_ranges(self, start=0, stop=None):
+        stop = self.num_students if stop is None else stop
+        step = self.students_per_batch()
+        return [(batch_start, min(batch_start + step, stop)) for batch_start in range(start, stop, step)]
+
+    def generate_batch(self, batch_start, batch_stop):
+        '''
+        Generates the students with indexes in range(batch_start, batch_stop) and their grades.
+        Students are (student_index, name, group_index) tuples and grades are
+        (student_index, subject_index, grade, date) tuples.
+        '''
+        self.reseed(batch_start)
+        students = []
+        grades = []
+        for student_index in range(batch_start, batch_stop):
+            students.append((student_index, self.fake.name(), self.random.randrange(self.num_groups)))
+            grades.extend(self.student_grades(student_index))
+        return students, grades
+
+    def iter_student_batches(self, start=0, stop=None):
+        for batch_start, batch_stop in self.batch_ranges(start, stop):
+            yield self.generate_batch(batch_start, batch_stop)
 
     def generate_fake_data(self):
-        groups = ['Group A', 'Group B', 'Group C']
-        lecturers = [self.fake.name() for _ in range(5)]
-        subjects = ['Mathematics', 'Physics', 'Chemistry', 'Biology', 'History', 'English']
-        students = [(self.fake.name(), random.choice(groups)) for _ in range(40)]
-               
+        groups = self.group_names()
+        lecturers = self.lecturer_names()
+        subjects = self.subject_names()
+        students = []
         grades = []
-        for student in students:
-            student_grades = []
-            for subject in subjects:
-                for _ in range(2):
-                    grade = random.randint(1, 6)
-                    date = self.fake.date_this_year(before_today=True, after_today=False)
-                    student_grades.append((student[0], subject, grade, date))
-            additional_grades_count = random.randint(10, 20) - len(student_grades)
-            for _ in range(additional_grades_count):
-                subject = random.choice(subjects)
-                grade = random.randint(1, 6)
-                date = self.fake.date_this_year(before_today=True, after_today=False)
-                student_grades.append((student[0], subject, grade, date))
-            grades.extend(student_grades)
+        for student_batch, grade_batch in self.iter_student_batches():
+            names = {}
+            for student_index, name, group_index in student_batch:
+                names[student_index] = name
+                students.append((name, groups[group_index]))
+            for student_index, subject_index, grade, date in grade_batch:
+                grades.append((names[student_index], subjects[subject_index], grade, date))
 
         return groups, lecturers, subjects, students, grades
 
+_worker_generator = None
+
+
+def _init_generator_worker(config):
+    global _worker_generator
+    _worker_generator = FakeDataGenerator(**config)
+
+
+def _generate_batch(batch_range):
+    return _worker_generator.generate_batch(*batch_range)
+
+
+class ParallelFakeDataGenerator:
+    '''
+    Class for generating fake data on a pool of worker processes. Takes a FakeDataGenerator and the number of workers as arguments.
+    The students are split into batches that are generated by the workers and handed back in order to the calling process,
+    which stays the only SQLite writer. Each batch is seeded on its own, so the output for a given seed is the same
+    as the one of the wrapped generator.
+    '''
+    def __init__(self, generator, workers=None):
+        self.generator = generator
+        self.workers = workers or os.cpu_count() or 1
+
+    def group_names(self):
+        return self.generator.group_names()
+
+    def lecturer_names(self):
+        return self.generator.lecturer_names()
+
+    def subject_names(self):
+        return self.generator.subject_names()
+
+    def iter_student_batches(self, start=0, stop=None):
+        batch_ranges = iter(self.generator.batch_ranges(start, stop))
+        # A bounded number of batches in flight keeps memory flat when the writer is slower than the workers.
+        max_pending = 2 * self.workers
+        import multiprocessing
+        with multiprocessing.Pool(self.workers, _init_generator_worker, (self.generator.config,)) as pool:
+            pending = deque()
+            for batch_range in batch_ranges:
+                pending.append(pool.apply_async(_generate_batch, (batch_range,)))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
 
 class InsertFakeData:
     '''
     Class for inserting fake data into the database. Takes a connection object as an argument.
     Uses other data insertion classes to insert the generated fake data into the respective tables.
+    The bulk mode streams batches from the generator through executemany and commits only every rows_per_transaction rows.
     '''
-    def __init__(self, connection):
+    def __init__(self, connection, generator=None):
+        self.connection = connection
         self.group_data = GroupData(connection)
         self.student_data = StudentData(connection)
         self.lecturer_data = LecturerData(connection)
         self.subject_data = SubjectData(connection)
         self.grade_data = GradeData(connection)
-        self.generator = FakeDataGenerator()
+        self.generator = generator if generator is not None else FakeDataGenerator()
 
     def insert_all_data(self):
         groups, lecturers, subjects, students, grades = self.generator.generate_fake_data()
@@ -212,86 +648,1334 @@ class InsertFakeData:
         for grade in grades:
             student_id = student_ids[grade[0]]
             subject_id = subject_ids[grade[1]]
-            self.grade_data.insert(student_id, subject_id, grade[2], grade[3].strftime('%Y-%m-%d'))
+            self.grade_data.insert(student_id, subject_id, grade[2], grade[3])
+
+    def next_id(self, table):
+        self.connection.cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+        return self.connection.cur.fetchone()[0]
+
+    def insert_reference_data(self):
+        '''
+        Inserts groups, lecturers and subjects. Returns the ids of the first group, subject and student,
+        which the student and grade batches are offset by.
+        '''
+        first_group_id = self.next_id('groups')
+        groups = self.generator.group_names()
+        self.group_data.insert_many(list(enumerate(groups, start=first_group_id)))
+
+        first_lecturer_id = self.next_id('lecturers')
+        lecturers = self.generator.lecturer_names()
+        self.lecturer_data.insert_many(list(enumerate(lecturers, start=first_lecturer_id)))
+
+        first_subject_id = self.next_id('subjects')
+        subjects = self.generator.subject_names()
+        self.subject_data.insert_many([(first_subject_id + i, subject, first_lecturer_id + i % len(lecturers))
+                                       for i, subject in enumerate(subjects)])
+
+        inserted = len(groups) + len(lecturers) + len(subjects)
+        return (first_group_id, first_subject_id, self.next_id('students')), inserted
+
+    def insert_batches(self, batches, first_ids, rows_per_transaction=None):
+        first_group_id, first_subject_id, first_student_id = first_ids
+        inserted = 0
+        uncommitted = 0
+        for students, grades in batches:
+            self.student_data.insert_many([(first_student_id + student_index, name, first_group_id + group_index)
+                                           for student_index, name, group_index in students])
+            self.grade_data.insert_many([(first_student_id + student_index, first_subject_id + subject_index, grade, date)
+                                         for student_index, subject_index, grade, date in grades])
+            inserted += len(students) + len(grades)
+            uncommitted += len(students) + len(grades)
+            if rows_per_transaction and uncommitted >= rows_per_transaction:
+                self.connection.conn.commit()
+                self.connection.settings.checkpoint(self.connection.conn)
+                uncommitted = 0
+        return inserted
+
+    def bulk_insert_all_data(self, rows_per_transaction=None, output=sys.stderr):
+        start_time = time.perf_counter()
+
+        with BulkLoadSettings(self.connection):
+            first_ids, inserted = self.insert_reference_data()
+            inserted += self.insert_batches(self.generator.iter_student_batches(), first_ids, rows_per_transaction)
+        self.connection.settings.checkpoint(self.connection.conn, 'TRUNCATE', force=True)
+
+        elapsed = time.perf_counter() - start_time
+        rows_per_sec = inserted / elapsed if elapsed > 0 else float('inf')
+        # The rate goes to stderr by default, so it never mixes with results written to stdout.
+        print(f"Inserted {inserted} rows in {elapsed:.2f} s ({rows_per_sec:.0f} rows/sec).", file=output)
+        return inserted
 
 
 class DatabaseInitializer:
     '''
     Class for initializing the database. Takes the database name as an argument.
-    Provides a method to initialize the database by creating tables and inserting fake data.
+    Provides a method to initialize the database by creating tables, inserting fake data and applying the schema migrations.
+    With bulk=True the data is inserted by the batched, single-transaction loader.
+    A preconfigured FakeDataGenerator or ParallelFakeDataGenerator can be passed to control the amount of generated data.
     '''
     def __init__(self, db_name):
         self.db_name = db_name
 
-    def initialize_database(self):
+    def initialize_database(self, bulk=False, rows_per_transaction=None, generator=None, output=sys.stderr):
         with CreateConnection(self.db_name) as connection:
             create_tables = CreateTables(connection)
             create_tables.create_tables()
 
-            insert_fake_data = InsertFakeData(connection)
-            insert_fake_data.insert_all_data()
+            insert_fake_data = InsertFakeData(connection, generator)
+            if bulk:
+                insert_fake_data.bulk_insert_all_data(rows_per_transaction, output)
+            else:
+                insert_fake_data.insert_all_data()
+
+            # Indexes are created after the data is loaded, which is faster than maintaining them row by row.
+            SchemaMigrator(connection).migrate()
+
+
+class DatabaseSnapshot:
+    '''
+    Class for saving a database to a snapshot file and creating databases from it instead of generating the data again.
+    Takes the path of the snapshot as an argument; a path ending in .gz is a gzip-compressed snapshot.
+    save() writes a compacted, consistent copy with VACUUM INTO. restore() decompresses a compressed snapshot by a plain
+    file copy and copies an uncompressed one with the SQLite backup API; the target database must not be open.
+    '''
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self.compressed = snapshot_path.endswith('.gz')
+
+    def save(self, db_name):
+        copy_path = self.snapshot_path + '.tmp'
+        plain_path = copy_path + '.db' if self.compressed else copy_path
+        for path in (copy_path, plain_path):
+            if os.path.exists(path):
+                os.remove(path)
+        conn = sqlite3.connect(db_name)
+        try:
+            conn.execute("VACUUM INTO ?", (plain_path,))
+        finally:
+            conn.close()
+        if self.compressed:
+            import gzip
+            import shutil
+            with open(plain_path, 'rb') as source, gzip.open(copy_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            os.remove(plain_path)
+        os.replace(copy_path, self.snapshot_path)
+
+    def restore(self, db_name):
+        copy_path = db_name + '.restore'
+        if self.compressed:
+            import gzip
+            import shutil
+            with gzip.open(self.snapshot_path, 'rb') as source, open(copy_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+        else:
+            source = sqlite3.connect(self.snapshot_path)
+            target = sqlite3.connect(copy_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        # Leftover WAL files of an earlier database with the same name would be replayed into the new one.
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_name + suffix):
+                os.remove(db_name + suffix)
+        os.replace(copy_path, db_name)
+
+
+class GradeArchiver:
+    '''
+    Class for moving old grades out of the hot database file. Takes a connection object and the archive directory as arguments.
+    rollover() moves the grades dated before a given day into one database file per year, grades_<year>.db,
+    and records the file in grade_archives, so the time-range reports can attach it. The summary tables follow
+    the moved grades, so the all-time reports cover the hot file only.
+    Every year is first copied and committed, then deleted from the hot file; running rollover() again
+    after an interruption finishes the job without duplicating grades.
+    '''
+    def __init__(self, connection, archive_dir):
+        self.conn = connection
+        self.cur = connection.cur
+        self.archive_dir = archive_dir
+
+    def database_dir(self):
+        self.cur.execute("PRAGMA database_list")
+        return os.path.dirname(os.path.abspath(self.cur.fetchone()[2]))
+
+    def rollover(self, before, vacuum=True):
+        '''
+        Archives the grades dated before the given date. Returns a list of (period, number of grades moved).
+        '''
+        before_day = day_number(before)
+        self.cur.execute("SELECT MIN(day) FROM grades WHERE day IS NOT NULL")
+        first_day = self.cur.fetchone()[0]
+        archived = []
+        if first_day is None:
+            return archived
+        year = (EPOCH + datetime.timedelta(days=first_day)).year
+        while day_number(datetime.date(year, 1, 1)) < before_day:
+            period_start = day_number(datetime.date(year, 1, 1))
+            period_end = min(day_number(datetime.date(year + 1, 1, 1)), before_day)
+            moved = self.archive_period(str(year), period_start, period_end)
+            if moved:
+                archived.append((str(year), moved))
+            year += 1
+        if archived and vacuum:
+            # Deleted pages are only returned to the file system by VACUUM.
+            self.conn.conn.commit()
+            self.cur.execute("VACUUM")
+        return archived
+
+    def archive_period(self, period, period_start, period_end):
+        self.cur.execute("SELECT EXISTS (SELECT 1 FROM grades WHERE day >= ? AND day < ?)", (period_start, period_end))
+        if not self.cur.fetchone()[0]:
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"grades_{period}.db")
+        schema = archive_schema(period)
+        self.conn.conn.commit()
+        self.cur.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        try:
+            self.cur.execute("BEGIN")
+            for statement in archive_statements(schema):
+                self.cur.execute(statement)
+            self.cur.execute(f'''INSERT OR REPLACE INTO {schema}.grades (id, student_id, subject_id, grade, date)
+                                SELECT id, student_id, subject_id, grade, date
+                                FROM main.grades
+                                WHERE day >= ? AND day < ?''', (period_start, period_end))
+            self.conn.conn.commit()
+
+            self.cur.execute("BEGIN")
+            self.cur.execute("DELETE FROM main.grades WHERE day >= ? AND day < ?", (period_start, period_end))
+            moved = self.cur.rowcount
+            if moved:
+                self.cur.execute(f'''INSERT INTO grade_archives (period, path, first_day, last_day, grade_count)
+                                    SELECT ?, ?, MIN(day), MAX(day), COUNT(*) FROM {schema}.grades WHERE true
+                                    ON CONFLICT (period) DO UPDATE SET path = excluded.path,
+                                                                       first_day = excluded.first_day,
+                                                                       last_day = excluded.last_day,
+                                                                       grade_count = excluded.grade_count''',
+                                 (period, os.path.relpath(os.path.abspath(path), self.database_dir())))
+            self.conn.conn.commit()
+        except sqlite3.Error:
+            self.conn.conn.rollback()
+            raise
+        finally:
+            self.cur.execute(f"DETACH DATABASE {schema}")
+        return moved
+
+
+# Columns of the tables that can be imported and exported, and the tables their foreign keys refer to.
+# A foreign key can also be given by name, in the column without the _id suffix.
+TABLE_COLUMNS = {
+    'groups': ['id', 'name'],
+    'lecturers': ['id', 'name'],
+    'subjects': ['id', 'name', 'lecturer_id'],
+    'students': ['id', 'name', 'group_id'],
+    'grades': ['id', 'student_id', 'subject_id', 'grade', 'date'],
+}
+FOREIGN_KEYS = {
+    'lecturer_id': 'lecturers',
+    'group_id': 'groups',
+    'student_id': 'students',
+    'subject_id': 'subjects',
+}
+INTEGER_COLUMNS = {'id', 'lecturer_id', 'group_id', 'student_id', 'subject_id', 'grade'}
+
+
+def data_file_format(path, file_format=None):
+    if file_format is not None:
+        return file_format
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+@contextmanager
+def open_data_file(path, mode):
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    else:
+        with open(path, mode, newline='', encoding='utf-8') as data_file:
+            yield data_file
+
+
+def read_records(input_file, file_format):
+    '''
+    Yields (line number, record dict) for every record of a CSV file with a header line or of a JSON-lines file.
+    '''
+    if file_format == 'csv':
+        reader = csv.DictReader(input_file)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"Line {line_number}, column {error.colno}: {error.msg}.") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"Line {line_number}: a record must be a JSON object.")
+            yield line_number, record
+
+
+def write_records(rows, fields, output_file, file_format):
+    '''
+    Writes rows of the given fields to a CSV file with a header line or to a JSON-lines file as they come. Returns the number of rows.
+    '''
+    written = 0
+    if file_format == 'csv':
+        writer = csv.writer(output_file)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([",".join(map(str, value)) if isinstance(value, list) else value for value in row])
+            written += 1
+    else:
+        for row in rows:
+            output_file.write(json.dumps(dict(zip(fields, row))) + "\n")
+            written += 1
+    output_file.flush()
+    return written
+
+
+def is_iso_date(value):
+    try:
+        return datetime.date.fromisoformat(value).isoformat() == value
+    except (TypeError, ValueError):
+        return False
+
+
+def integer_value(value):
+    # Only ints and strings of digits count; int() would truncate 4.9 to 4 and read true as 1.
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().removeprefix('-').isdecimal() and value.isascii():
+        return int(value)
+    return None
+
+
+class DataImporter:
+    '''
+    Class for loading groups, lecturers, subjects, students and grades from CSV or JSON-lines files. Takes a connection object as an argument.
+    Records are read as a stream and inserted batch_size at a time with executemany, committing every rows_per_transaction rows.
+    Foreign keys are given as ids (group_id) or as names (group); names are resolved through a map of all names of the table,
+    loaded once, and the ids of every batch are checked with one query per referenced table.
+    A record that cannot be imported raises ValueError with its line number; the rows committed before it stay imported.
+    '''
+    def __init__(self, connection, batch_size=10000, rows_per_transaction=100000):
+        self.connection = connection
+        self.cur = connection.cur
+        self.batch_size = batch_size
+        self.rows_per_transaction = rows_per_transaction
+        self.name_maps = {}
+
+    def name_map(self, table):
+        if table not in self.name_maps:
+            names = {}
+            for row_id, name in self.connection.conn.execute(f"SELECT id, name FROM {table}"):
+                # A name shared by several rows maps to None, as it cannot tell them apart.
+                names[name] = None if name in names else row_id
+            self.name_maps[table] = names
+        return self.name_maps[table]
+
+    def resolve(self, column, name, line_number):
+        names = self.name_map(FOREIGN_KEYS[column])
+        entity = column[:-len('_id')]
+        if name not in names:
+            raise ValueError(f"Line {line_number}: there is no such {entity} {name!r}.")
+        if names[name] is None:
+            raise ValueError(f"Line {line_number}: more than one {entity} is named {name!r}, give the {column} instead.")
+        return names[name]
+
+    def convert(self, table, record, line_number):
+        row = []
+        for column in TABLE_COLUMNS[table]:
+            value = record.get(column)
+            if value == '':
+                value = None
+            if value is None and column in FOREIGN_KEYS and record.get(column[:-len('_id')]) not in (None, ''):
+                value = self.resolve(column, record[column[:-len('_id')]], line_number)
+            elif value is not None and column in INTEGER_COLUMNS:
+                integer = integer_value(value)
+                if integer is None:
+                    raise ValueError(f"Line {line_number}: {column} must be an integer, not {value!r}.")
+                value = integer
+            elif value is not None and column == 'date' and not is_iso_date(value):
+                # SQLite only reads YYYY-MM-DD dates, any other date would get no day number and miss every range report.
+                raise ValueError(f"Line {line_number}: date must be a YYYY-MM-DD date, not {value!r}.")
+            row.append(value)
+        return tuple(row)
+
+    def validate(self, table, batch):
+        for index, column in enumerate(TABLE_COLUMNS[table]):
+            if column not in FOREIGN_KEYS:
+                continue
+            ids = {row[index] for _, row in batch if row[index] is not None}
+            if not ids:
+                continue
+            missing = {row_id for (row_id,) in self.connection.conn.execute(
+                f"SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM {FOREIGN_KEYS[column]})",
+                (json.dumps(sorted(ids)),))}
+            for line_number, row in batch:
+                if row[index] in missing:
+                    raise ValueError(f"Line {line_number}: there is no {column[:-len('_id')]} with id {row[index]}.")
+
+    def insert(self, table, batch):
+        self.validate(table, batch)
+        columns = TABLE_COLUMNS[table]
+        statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        if not self.connection.conn.in_transaction:
+            self.cur.execute("BEGIN")
+        self.cur.execute("SAVEPOINT import_batch")
+        try:
+            self.cur.executemany(statement, [row for _, row in batch])
+        except sqlite3.IntegrityError:
+            # Only a failing batch is inserted again row by row, to find the line that violates a constraint.
+            self.cur.execute("ROLLBACK TO import_batch")
+            for line_number, row in batch:
+                try:
+                    self.cur.execute(statement, row)
+                except sqlite3.IntegrityError as error:
+                    raise ValueError(f"Line {line_number}: {error}.") from None
+        finally:
+            self.cur.execute("RELEASE import_batch")
+        return len(batch)
+
+    def import_file(self, table, input_file, file_format):
+        '''
+        Imports the records of an open file into a table. Returns the number of imported rows.
+        '''
+        if table not in TABLE_COLUMNS:
+            raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLE_COLUMNS)}.")
+        start_time = time.perf_counter()
+        committed = 0
+        uncommitted = 0
+        batch = []
+        try:
+            with BulkLoadSettings(self.connection):
+                for line_number, record in read_records(input_file, file_format):
+                    batch.append((line_number, self.convert(table, record, line_number)))
+                    if len(batch) < self.batch_size:
+                        continue
+                    uncommitted += self.insert(table, batch)
+                    batch = []
+                    if uncommitted >= self.rows_per_transaction:
+                        self.connection.conn.commit()
+                        self.connection.settings.checkpoint(self.connection.conn)
+                        committed += uncommitted
+                        uncommitted = 0
+                if batch:
+                    uncommitted += self.insert(table, batch)
+            committed += uncommitted
+        except ValueError as error:
+            raise ValueError(f"{error} {committed} rows had been imported before it.") from error
+        finally:
+            self.name_maps.pop(table, None)
+
+        elapsed = time.perf_counter() - start_time
+        rows_per_sec = committed / elapsed if elapsed > 0 else float('inf')
+        print(f"Imported {committed} rows into {table} in {elapsed:.2f} s ({rows_per_sec:.0f} rows/sec).", file=sys.stderr)
+        return committed
+
+
+class ConnectionPool:
+    '''
+    Class for sharing long-lived database connections between threads. Takes the database name and the pool size as arguments.
+    Connections are opened on first use, up to size of them, configured as readers by the ConnectionSettings,
+    and each keeps a cache of prepared statements.
+    A connection acquired for a tuple of archives (period, path) attaches just those archive databases and gets
+    a temporary dated_grades view over the hot and archived grades before it is handed out.
+    SQLite attaches at most 10 databases to a connection by default, so a range spanning more archives is refused.
+    '''
+    def __init__(self, db_name, size=4, cached_statements=256, settings=None):
+        self.db_name = db_name
+        self.size = size
+        self.settings = settings if settings is not None else ConnectionSettings()
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.attached = {}
+
+    def open_connection(self):
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=self.cached_statements)
+        return self.settings.configure_reader(conn)
+
+    def acquire(self, archives=None):
+        conn = self.checkout()
+        if archives is not None and self.attached.get(conn) != archives:
+            try:
+                self.attach_archives(conn, archives)
+            except Exception:
+                self.release(conn)
+                raise
+        return conn
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.opened < self.size:
+                self.opened += 1
+                return self.open_connection()
+        return self.idle.get()
+
+    def attach_archives(self, conn, archives):
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(archives) > limit:
+            raise ValueError(f"The range spans {len(archives)} archives, but only {limit} can be attached; "
+                             "ask for a shorter range.")
+        for period, _ in self.attached.pop(conn, None) or ():
+            conn.execute(f"DETACH DATABASE {archive_schema(period)}")
+        database_dir = os.path.dirname(os.path.abspath(self.db_name))
+        selects = ["SELECT id, student_id, subject_id, grade, day FROM main.grades"]
+        attached = []
+        # Kept up to date while attaching, so a failed attach is detached again on the next acquire.
+        self.attached[conn] = attached
+        for period, path in archives:
+            conn.execute(f"ATTACH DATABASE ? AS {archive_schema(period)}", (os.path.join(database_dir, path),))
+            attached.append((period, path))
+            selects.append(f"SELECT id, student_id, subject_id, grade, day FROM {archive_schema(period)}.grades")
+        conn.execute("DROP VIEW IF EXISTS temp.dated_grades")
+        conn.execute("CREATE TEMP VIEW dated_grades AS " + " UNION ALL ".join(selects))
+        self.attached[conn] = archives
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self, archives=None):
+        conn = self.acquire(archives)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self.lock:
+            while True:
+                try:
+                    conn = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                self.attached.pop(conn, None)
+                conn.close()
+                self.opened -= 1
+
+
+def estimate_size(rows):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class ResultCache:
+    '''
+    Class for caching query results. Takes the memory bound in bytes and optionally a time to live in seconds as arguments.
+    Entries are evicted least recently used first once the bound is exceeded. Every entry remembers the data version
+    it was read at and is dropped when it is looked up with a different one.
+    '''
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, data_version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            rows, size, version, expires_at = entry
+            if version != data_version or (expires_at is not None and time.monotonic() > expires_at):
+                self.remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, key, data_version, rows):
+        size = estimate_size(rows)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (rows, size, data_version, expires_at)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def parameter_shape(parameters):
+    # Id lists are told apart by their length and other values by their type, so one shape covers many calls.
+    shape = []
+    for value in parameters or ():
+        shape.append(type(value).__name__)
+        if isinstance(value, str) and value.startswith('['):
+            # A name may start with a bracket too, so only a string that parses as a list counts as an id list.
+            try:
+                ids = json.loads(value)
+            except ValueError:
+                continue
+            if isinstance(ids, list):
+                shape[-1] = f"ids[{len(ids)}]"
+    return ", ".join(shape)
+
+
+def format_query_plan(rows):
+    depths = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        plan.append("  " * depths[node_id] + detail)
+    return plan
+
+
+class QueryInstrumentation:
+    '''
+    Class for measuring the queries run by a QueryExecutor, passed to it as instrumentation; without one the executor
+    does none of this work. For every query and parameter shape it records the calls, wall time, time spent waiting
+    for a pooled connection, rows returned and SQLite VM steps, counted by a progress handler in units of step_interval
+    instructions, together with a histogram of wall times. Results served from the cache are not recorded.
+    Queries slower than slow_threshold seconds are logged as warnings together with their EXPLAIN QUERY PLAN.
+    '''
+    HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, slow_threshold=None, step_interval=100, logger=None):
+        self.slow_threshold = slow_threshold
+        self.step_interval = step_interval
+        if logger is None:
+            import logging
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+        self.stats = {}
+        self.slow_queries = 0
+        self.lock = threading.Lock()
+
+    def start(self, conn):
+        steps = [0]
+
+        def count_steps():
+            steps[0] += 1
+
+        conn.set_progress_handler(count_steps, self.step_interval)
+        return steps
+
+    def stop(self, conn):
+        conn.set_progress_handler(None, 0)
+
+    def record(self, key, parameters, wall_time, wait_time, rows, steps, explain):
+        '''
+        Records one query. explain is called for the query plan lines only when the query was slow.
+        '''
+        shape = parameter_shape(parameters)
+        wall_ms = wall_time * 1000
+        bucket = next((i for i, bound in enumerate(self.HISTOGRAM_BOUNDS_MS) if wall_ms <= bound), len(self.HISTOGRAM_BOUNDS_MS))
+        slow = self.slow_threshold is not None and wall_time > self.slow_threshold
+        with self.lock:
+            stats = self.stats.setdefault((key, shape), {
+                'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'wait_ms': 0.0, 'rows': 0, 'steps': 0,
+                'histogram': [0] * (len(self.HISTOGRAM_BOUNDS_MS) + 1),
+            })
+            stats['calls'] += 1
+            stats['total_ms'] += wall_ms
+            stats['max_ms'] = max(stats['max_ms'], wall_ms)
+            stats['wait_ms'] += wait_time * 1000
+            stats['rows'] += rows
+            stats['steps'] += steps[0] * self.step_interval
+            stats['histogram'][bucket] += 1
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            try:
+                plan = "\n".join(explain())
+            except sqlite3.Error as error:
+                plan = f"(no plan: {error})"
+            self.logger.warning("Slow query %s (%s): %.1f ms, %d rows, %d steps, waited %.1f ms for a connection\n%s",
+                                key, shape, wall_ms, rows, steps[0] * self.step_interval, wait_time * 1000, plan)
+
+    def export(self):
+        '''
+        Returns the aggregated statistics as a JSON-serializable dict: {query: {parameter shape: stats}}.
+        Every histogram count is of the calls that took at most the matching bound in milliseconds, the last one of the rest.
+        '''
+        with self.lock:
+            queries = {}
+            for (key, shape), stats in sorted(self.stats.items()):
+                queries.setdefault(key, {})[shape] = dict(stats, histogram=list(stats['histogram']),
+                                                          average_ms=stats['total_ms'] / stats['calls'])
+            return {
+                'histogram_bounds_ms': list(self.HISTOGRAM_BOUNDS_MS) + [None],
+                'slow_threshold_ms': self.slow_threshold * 1000 if self.slow_threshold is not None else None,
+                'slow_queries': self.slow_queries,
+                'queries': queries,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.slow_queries = 0
 
 
 class QueryExecutor:
     '''
     Class for executing SQL queries. Takes the database name as an argument.
     Provides methods to execute queries from a file, check if specific data exists, and verify relationships between data.
+    Queries run on a pool of long-lived connections, query files are read once and the latency of every call is recorded.
+    Results of the query files are cached up to cache_max_bytes (0 disables the cache) and invalidated
+    whenever PRAGMA data_version shows that another connection has committed a change.
+    An optional QueryInstrumentation records detailed statistics and logs slow queries.
     '''
-    def __init__(self, db_name):
+    def __init__(self, db_name, pool_size=4, cache_max_bytes=16 * 1024 * 1024, cache_ttl=None, settings=None,
+                 instrumentation=None):
         self.db_name = db_name
+        self.settings = settings if settings is not None else ConnectionSettings()
+        self.pool = ConnectionPool(db_name, pool_size, settings=self.settings)
+        self.cache = ResultCache(cache_max_bytes, cache_ttl) if cache_max_bytes else None
+        # This connection only ever reads data_version, so every commit is a change made by another connection.
+        self.version_conn = self.settings.configure_reader(sqlite3.connect(db_name, check_same_thread=False))
+        self.version_lock = threading.Lock()
+        self.queries = {}
+        self.queries_lock = threading.Lock()
+        self.latencies = {}
+        self.latencies_lock = threading.Lock()
+        self.last_latency = None
+        self.active_connections = {}
+        self.archives = []
+        self.archives_version = None
+        self.instrumentation = instrumentation
 
-    def execute_sql_query(self, query_file_path, parameters=None):
-        with open(query_file_path, 'r') as query_file:
-            query = query_file.read()
+    def __enter__(self):
+        return self
 
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            if parameters:
-                cursor.execute(query, parameters)
-            else:
-                cursor.execute(query)
-            result = cursor.fetchall()
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.version_conn.close()
+
+    def data_version(self):
+        with self.version_lock:
+            return self.version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh_archives(self):
+        '''
+        Reads the list of archived periods for the time-range queries, again only after another connection has committed a change.
+        '''
+        data_version = self.data_version()
+        if data_version != self.archives_version:
+            self.archives = self.run('archives', "SELECT period, path, first_day, last_day FROM grade_archives ORDER BY period",
+                                     None, sqlite3.Cursor.fetchall)
+            self.archives_version = data_version
+
+    def archives_between(self, first_day, last_day):
+        '''
+        Returns the (period, path) of every archive holding grades from the inclusive range of day numbers.
+        '''
+        self.refresh_archives()
+        return tuple((period, path) for period, path, archive_first_day, archive_last_day in self.archives
+                     if archive_first_day <= last_day and archive_last_day >= first_day)
+
+    def load_query(self, query_file_path):
+        query = self.queries.get(query_file_path)
+        if query is None:
+            with open(query_file_path, 'r') as query_file:
+                query = query_file.read()
+            with self.queries_lock:
+                self.queries[query_file_path] = query
+        return query
+
+    def preload_queries(self, query_file_paths):
+        for query_file_path in query_file_paths:
+            self.load_query(query_file_path)
+
+    def record_latency(self, key, latency):
+        self.last_latency = latency
+        with self.latencies_lock:
+            stats = self.latencies.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += latency
+            stats[2] = max(stats[2], latency)
+
+    def latency_stats(self):
+        '''
+        Returns the number of calls and the total, average and maximum latency in seconds for every query.
+        '''
+        with self.latencies_lock:
+            return {key: {'calls': calls, 'total': total, 'average': total / calls, 'max': maximum}
+                    for key, (calls, total, maximum) in self.latencies.items()}
+
+    def query_plan(self, conn, query, parameters):
+        return format_query_plan(conn.execute("EXPLAIN QUERY PLAN " + query, parameters or ()).fetchall())
+
+    def run(self, key, query, parameters, fetch, archives=None):
+        instrumentation = self.instrumentation
+        start_time = time.perf_counter()
+        with self.pool.connection(archives) as conn:
+            wait_time = time.perf_counter() - start_time
+            thread_id = threading.get_ident()
+            self.active_connections[thread_id] = conn
+            steps = instrumentation.start(conn) if instrumentation is not None else None
+            try:
+                cursor = conn.cursor()
+                if parameters:
+                    cursor.execute(query, parameters)
+                else:
+                    cursor.execute(query)
+                result = fetch(cursor)
+                cursor.close()
+            finally:
+                if instrumentation is not None:
+                    instrumentation.stop(conn)
+                del self.active_connections[thread_id]
+            latency = time.perf_counter() - start_time
+            if instrumentation is not None:
+                rows = len(result) if isinstance(result, list) else int(result is not None)
+                instrumentation.record(key, parameters, latency, wait_time, rows, steps,
+                                       lambda: self.query_plan(conn, query, parameters))
+        self.record_latency(key, latency)
         return result
 
-    def check_subject_exists(self, subject):
-        with sqlite3.connect(self.db_name) as conn:
+    def execute_sql_query(self, query_file_path, parameters=None, archives=None):
+        query = self.load_query(query_file_path)
+        if self.cache is None:
+            return self.run(query_file_path, query, parameters, sqlite3.Cursor.fetchall, archives)
+
+        start_time = time.perf_counter()
+        key = (query_file_path, tuple(parameters) if parameters else None)
+        # The version is read before the query runs, so a concurrent commit can only make the entry look stale.
+        data_version = self.data_version()
+        result = self.cache.get(key, data_version)
+        if result is not None:
+            self.record_latency(query_file_path, time.perf_counter() - start_time)
+            return list(result)
+        result = self.run(query_file_path, query, parameters, sqlite3.Cursor.fetchall, archives)
+        self.cache.put(key, data_version, result)
+        return list(result)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def iter_sql_query(self, query_file_path, parameters=None, batch_size=1000, archives=None):
+        '''
+        Yields the rows of a query file lazily, fetching batch_size of them at a time. The connection stays checked out
+        of the pool until the rows are exhausted or the iterator is closed. Results are not cached.
+        '''
+        return self.iter_query(query_file_path, self.load_query(query_file_path), parameters, batch_size, archives)
+
+    def iter_query(self, key, query, parameters=None, batch_size=1000, archives=None):
+        instrumentation = self.instrumentation
+        start_time = time.perf_counter()
+        with self.pool.connection(archives) as conn:
+            wait_time = time.perf_counter() - start_time
+            steps = instrumentation.start(conn) if instrumentation is not None else None
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM subjects WHERE name = ?", (subject,))
-            result = cursor.fetchone()
-        return result[0] > 0
+            row_count = 0
+            try:
+                if parameters:
+                    cursor.execute(query, parameters)
+                else:
+                    cursor.execute(query)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    row_count += len(rows)
+                    yield from rows
+            finally:
+                cursor.close()
+                if instrumentation is not None:
+                    instrumentation.stop(conn)
+            # The time includes the caller's work between batches, which is what a streaming reader waits for.
+            latency = time.perf_counter() - start_time
+            if instrumentation is not None:
+                instrumentation.record(key, parameters, latency, wait_time, row_count, steps,
+                                       lambda: self.query_plan(conn, query, parameters))
+        self.record_latency(key, latency)
+
+    def explain_query_plan(self, query_file_path, parameters=None):
+        query = "EXPLAIN QUERY PLAN " + self.load_query(query_file_path)
+        return format_query_plan(self.run('explain', query, parameters, sqlite3.Cursor.fetchall))
+
+    def count(self, key, query, parameters):
+        return self.run(key, query, parameters, sqlite3.Cursor.fetchone)[0]
+
+    def check_subject_exists(self, subject):
+        return self.count('check_subject_exists', "SELECT COUNT(*) FROM subjects WHERE name = ?", (subject,)) > 0
 
     def check_lecturer_exists(self, lecturer):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM lecturers WHERE name = ?", (lecturer,))
-            result = cursor.fetchone()
-        return result[0] > 0
+        return self.count('check_lecturer_exists', "SELECT COUNT(*) FROM lecturers WHERE name = ?", (lecturer,)) > 0
 
     def check_student_exists(self, student):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM students WHERE name = ?", (student,))
-            result = cursor.fetchone()
-        return result[0] > 0
+        return self.count('check_student_exists', "SELECT COUNT(*) FROM students WHERE name = ?", (student,)) > 0
 
     def check_group_exists(self, group):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM groups WHERE name = ?", (group,))
-            result = cursor.fetchone()
-        return result[0] > 0
-    
+        return self.count('check_group_exists', "SELECT COUNT(*) FROM groups WHERE name = ?", (group,)) > 0
+
     def check_lecturer_teaches_subject(self, lecturer, subject):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM subjects
-                WHERE lecturer_id = (SELECT id FROM lecturers WHERE name = ?)
-                AND name = ?
-            """, (lecturer, subject))
-            result = cursor.fetchone()
-        return result[0] > 0
+        return self.count('check_lecturer_teaches_subject', """
+            SELECT COUNT(*)
+            FROM subjects
+            WHERE lecturer_id = (SELECT id FROM lecturers WHERE name = ?)
+            AND name = ?
+        """, (lecturer, subject)) > 0
+
+
+class RunningQuery:
+    '''
+    Class for tracking a query handed to a worker thread, so it can be interrupted from another thread.
+    Takes the QueryExecutor the query runs on as an argument.
+    '''
+    def __init__(self, query_executor):
+        self.query_executor = query_executor
+        self.thread_id = None
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def run(self, function, args):
+        with self.lock:
+            if self.finished:
+                raise sqlite3.OperationalError("interrupted")
+            self.thread_id = threading.get_ident()
+        try:
+            return function(*args)
+        finally:
+            with self.lock:
+                self.finished = True
+
+    def interrupt(self):
+        # Under the lock the worker cannot finish this query and move on to another one in between.
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            conn = self.query_executor.active_connections.get(self.thread_id)
+            if conn is not None:
+                conn.interrupt()
+
+
+class AsyncQueryExecutor:
+    '''
+    Async counterpart of QueryExecutor for asyncio services. Takes the database name as an argument.
+    Queries run on a pool of worker threads, each with its own read connection, so the event loop is never blocked.
+    At most max_pending calls are queued for the workers; further callers wait for a free slot. A call that is cancelled
+    or exceeds its timeout interrupts the statement it is running.
+    '''
+    def __init__(self, db_name, workers=4, max_pending=None, timeout=None, **query_executor_options):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self.query_executor = QueryExecutor(db_name, pool_size=workers, **query_executor_options)
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = asyncio.Semaphore(max_pending or 4 * workers)
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        '''
+        Closes the executor from a coroutine. Waiting for the running queries happens on a helper thread,
+        so the event loop keeps serving other tasks meanwhile.
+        '''
+        import asyncio
+        await asyncio.to_thread(self.close)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.query_executor.close()
+
+    async def submit(self, function, *args, timeout=None):
+        import asyncio
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(self.run(function, args), timeout)
+
+    async def run(self, function, args):
+        import asyncio
+        async with self.slots:
+            running_query = RunningQuery(self.query_executor)
+            future = asyncio.get_running_loop().run_in_executor(self.executor, running_query.run, function, args)
+            try:
+                return await future
+            except asyncio.CancelledError:
+                running_query.interrupt()
+                raise
+
+    async def execute_sql_query(self, query_file_path, parameters=None, timeout=None):
+        return await self.submit(self.query_executor.execute_sql_query, query_file_path, parameters, timeout=timeout)
+
+    async def check_subject_exists(self, subject, timeout=None):
+        return await self.submit(self.query_executor.check_subject_exists, subject, timeout=timeout)
+
+    async def check_lecturer_exists(self, lecturer, timeout=None):
+        return await self.submit(self.query_executor.check_lecturer_exists, lecturer, timeout=timeout)
+
+    async def check_student_exists(self, student, timeout=None):
+        return await self.submit(self.query_executor.check_student_exists, student, timeout=timeout)
+
+    async def check_group_exists(self, group, timeout=None):
+        return await self.submit(self.query_executor.check_group_exists, group, timeout=timeout)
+
+    async def check_lecturer_teaches_subject(self, lecturer, subject, timeout=None):
+        return await self.submit(self.query_executor.check_lecturer_teaches_subject, lecturer, subject, timeout=timeout)
+
+
+class StudentAverage(NamedTuple):
+    position: int
+    student_id: int
+    name: str
+    average_grade: float
+
+
+class GroupAverage(NamedTuple):
+    group_id: int
+    name: str
+    average_grade: float
+
+
+class SubjectAverage(NamedTuple):
+    subject_id: int
+    name: str
+    average_grade: float
+
+
+class Student(NamedTuple):
+    student_id: int
+    name: str
+
+
+class Subject(NamedTuple):
+    subject_id: int
+    name: str
+
+
+class StudentGrades(NamedTuple):
+    student_id: int
+    name: str
+    grades: list
+
+
+class NameResolver:
+    '''
+    Class for resolving group, subject and lecturer names to ids. Takes a QueryExecutor as an argument.
+    All names are loaded into dictionaries with one query and reloaded only after PRAGMA data_version shows a change,
+    so validating a request does not cost a round trip. A name maps to a list of ids, because names are not unique.
+    '''
+    ENTITIES = ('group', 'subject', 'lecturer')
+
+    def __init__(self, query_executor):
+        self.query_executor = query_executor
+        self.lock = threading.Lock()
+        self.data_version = None
+        self.ids = {entity: {} for entity in self.ENTITIES}
+        self.subject_lecturers = {}
+
+    def load(self):
+        rows = self.query_executor.run('load_names', """
+            SELECT 'group', id, name, NULL FROM groups
+            UNION ALL
+            SELECT 'subject', id, name, lecturer_id FROM subjects
+            UNION ALL
+            SELECT 'lecturer', id, name, NULL FROM lecturers
+        """, None, sqlite3.Cursor.fetchall)
+        ids = {entity: {} for entity in self.ENTITIES}
+        subject_lecturers = {}
+        for entity, entity_id, name, lecturer_id in rows:
+            ids[entity].setdefault(name, []).append(entity_id)
+            if entity == 'subject':
+                subject_lecturers[entity_id] = lecturer_id
+        return ids, subject_lecturers
+
+    def refresh(self):
+        data_version = self.query_executor.data_version()
+        if data_version != self.data_version:
+            with self.lock:
+                if data_version != self.data_version:
+                    self.ids, self.subject_lecturers = self.load()
+                    self.data_version = data_version
+
+    def exists(self, entity, name):
+        self.refresh()
+        return name in self.ids[entity]
+
+    def resolve(self, entity, name):
+        self.refresh()
+        ids = self.ids[entity].get(name)
+        if not ids:
+            raise LookupError(f"There is no such {entity}.")
+        return ids
+
+    def resolve_taught_subjects(self, lecturer, subject):
+        lecturer_ids = self.resolve('lecturer', lecturer)
+        subject_ids = [subject_id for subject_id in self.resolve('subject', subject)
+                       if self.subject_lecturers[subject_id] in lecturer_ids]
+        if not subject_ids:
+            raise LookupError(f"Lecturer {lecturer} does not teach {subject}.")
+        return subject_ids
+
+
+def ids_parameter(ids):
+    # The queries take lists of ids as a JSON array and read them with json_each.
+    return json.dumps(ids)
+
+
+class UniversityReports:
+    '''
+    Class for asking the report questions. Takes a QueryExecutor as an argument.
+    Provides one method per question; ranking, ties and grouping are done by the queries,
+    so every method returns only the rows the caller needs as named tuples.
+    Names are resolved to ids by a NameResolver before the query runs; an unknown name raises LookupError.
+    With stream=True a method returns an iterator that fetches the rows lazily in batches of batch_size.
+    The questions about grades also take since and until dates (inclusive, either may be left out); they are then
+    answered from the grades of that period only, archived ones included, by the _range variant of the query.
+    '''
+    QUESTIONS = {
+        1: 'top_students',
+        2: 'best_students_in_subject',
+        3: 'group_averages_in_subject',
+        4: 'group_averages',
+        5: 'lecturer_subjects',
+        6: 'group_students',
+        7: 'group_subject_grades',
+        8: 'lecturer_subject_averages',
+        9: 'student_subjects',
+        10: 'lecturer_student_subjects',
+    }
+    ROW_TYPES = {
+        1: StudentAverage,
+        2: StudentAverage,
+        3: GroupAverage,
+        4: GroupAverage,
+        5: Subject,
+        6: Student,
+        7: StudentGrades,
+        8: SubjectAverage,
+        9: Subject,
+        10: Subject,
+    }
+
+    def __init__(self, query_executor, names=None, batch_size=1000):
+        self.query_executor = query_executor
+        self.names = names if names is not None else NameResolver(query_executor)
+        self.batch_size = batch_size
+
+    def answer(self, question, parameters=None, stream=False):
+        '''
+        Answers a question by its number. The parameters are a dict of keyword arguments or a list of positional ones.
+        '''
+        if question not in self.QUESTIONS:
+            raise ValueError(f"Unknown question {question!r}, expected a number from 1 to 10.")
+        method = getattr(self, self.QUESTIONS[question])
+        if isinstance(parameters, dict):
+            return method(**parameters, stream=stream)
+        return method(*(parameters or ()), stream=stream)
+
+    def rows(self, query_file_path, parameters, convert, stream, since=None, until=None):
+        archives = None
+        if since is not None or until is not None:
+            first_day, last_day = day_bounds(since, until)
+            archives = self.query_executor.archives_between(first_day, last_day)
+            query_file_path = query_file_path.replace(".sql", "_range.sql")
+            parameters = tuple(parameters or ()) + (first_day, last_day)
+        if stream:
+            return map(convert, self.query_executor.iter_sql_query(query_file_path, parameters, self.batch_size, archives))
+        return [convert(row) for row in self.query_executor.execute_sql_query(query_file_path, parameters, archives)]
+
+    def require_student(self, rows, student, stream):
+        # Students are too many to keep in memory, so their names are looked up by the indexed query itself
+        # and only an empty result costs a second round trip to tell an unknown student apart.
+        def checked_rows():
+            found = False
+            for row in rows:
+                found = True
+                yield row
+            if not found and not self.query_executor.check_student_exists(student):
+                raise LookupError("There is no such student.")
+        return checked_rows() if stream else list(checked_rows())
+
+    def top_students(self, stream=False, since=None, until=None):
+        return self.rows("query_1.sql", None, StudentAverage._make, stream, since, until)
+
+    def best_students_in_subject(self, subject, stream=False, since=None, until=None):
+        subject_ids = ids_parameter(self.names.resolve('subject', subject))
+        return self.rows("query_2.sql", (subject_ids,), lambda row: StudentAverage(1, *row), stream, since, until)
+
+    def group_averages_in_subject(self, subject, stream=False, since=None, until=None):
+        subject_ids = ids_parameter(self.names.resolve('subject', subject))
+        return self.rows("query_3.sql", (subject_ids,), GroupAverage._make, stream, since, until)
+
+    def group_averages(self, stream=False, since=None, until=None):
+        return self.rows("query_4.sql", None, GroupAverage._make, stream, since, until)
+
+    def lecturer_subjects(self, lecturer, stream=False):
+        lecturer_ids = ids_parameter(self.names.resolve('lecturer', lecturer))
+        return self.rows("query_5.sql", (lecturer_ids,), Subject._make, stream)
+
+    def group_students(self, group, stream=False):
+        group_ids = ids_parameter(self.names.resolve('group', group))
+        return self.rows("query_6.sql", (group_ids,), Student._make, stream)
+
+    def group_subject_grades(self, group, subject, stream=False, since=None, until=None):
+        group_ids = ids_parameter(self.names.resolve('group', group))
+        subject_ids = ids_parameter(self.names.resolve('subject', subject))
+
+        def student_grades(row):
+            student_id, name, grades = row
+            return StudentGrades(student_id, name, [int(grade) for grade in grades.split(',')] if grades else [])
+
+        return self.rows("query_7.sql", (group_ids, subject_ids), student_grades, stream, since, until)
+
+    def lecturer_subject_averages(self, lecturer, subject, stream=False, since=None, until=None):
+        subject_ids = ids_parameter(self.names.resolve_taught_subjects(lecturer, subject))
+        return self.rows("query_8.sql", (subject_ids,), SubjectAverage._make, stream, since, until)
+
+    def student_subjects(self, student, stream=False, since=None, until=None):
+        rows = self.rows("query_9.sql", (student,), Subject._make, stream, since, until)
+        return self.require_student(rows, student, stream)
+
+    def lecturer_student_subjects(self, lecturer, student, stream=False, since=None, until=None):
+        lecturer_ids = ids_parameter(self.names.resolve('lecturer', lecturer))
+        rows = self.rows("query_10.sql", (lecturer_ids, student), Subject._make, stream, since, until)
+        return self.require_student(rows, student, stream)
+
+
+class BatchReportRunner:
+    '''
+    Class for answering report questions without the interactive prompt. Takes a UniversityReports object
+    and the number of worker threads as arguments. Reads JSON lines like {"question": 2, "parameters": {"subject": "Physics"}},
+    answers them concurrently and writes one JSON line per request, in input order, as soon as it is ready.
+    With stream=True the requests are answered one by one and every result is serialized row by row while it is fetched,
+    so memory stays flat even for results of millions of rows.
+    '''
+    def __init__(self, reports, workers=4, stream=False):
+        self.reports = reports
+        self.workers = workers
+        self.stream = stream
+
+    def parse(self, line):
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("A request must be a JSON object.")
+        response = {key: request[key] for key in ('id', 'request_id') if key in request}
+        response['question'] = request.get('question')
+        return request, response
+
+    def answer(self, line):
+        # A line that cannot be parsed gets an error line of its own instead of stopping the run.
+        response = {'question': None}
+        try:
+            request, response = self.parse(line)
+            rows = self.reports.answer(int(request['question']), request.get('parameters'))
+            response['result'] = [row._asdict() for row in rows]
+        except (LookupError, TypeError, ValueError, sqlite3.Error) as error:
+            response['error'] = f"{type(error).__name__}: {error}"
+        return response
+
+    def write_streamed(self, line, output):
+        response = {'question': None}
+        try:
+            request, response = self.parse(line)
+            rows = iter(self.reports.answer(int(request['question']), request.get('parameters'), stream=True))
+            # The first row is fetched before anything is written, so a failing request still gets an error line.
+            first_row = next(rows, None)
+        except (LookupError, TypeError, ValueError, sqlite3.Error) as error:
+            response['error'] = f"{type(error).__name__}: {error}"
+            output.write(json.dumps(response) + "\n")
+            return
+        output.write(json.dumps(response)[:-1] + ', "result": [')
+        if first_row is not None:
+            output.write(json.dumps(first_row._asdict()))
+            for row in rows:
+                output.write(", " + json.dumps(row._asdict()))
+        output.write("]}\n")
+
+    def run(self, lines, output):
+        start_time = time.perf_counter()
+        answered = 0
+        requests = (line for line in lines if line.strip())
+        if self.stream:
+            for line in requests:
+                self.write_streamed(line, output)
+                answered += 1
+        else:
+            # A bounded number of requests in flight keeps memory flat for arbitrarily long inputs.
+            max_pending = 4 * self.workers
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(self.workers) as executor:
+                pending = deque()
+                for line in requests:
+                    pending.append(executor.submit(self.answer, line))
+                    if len(pending) >= max_pending:
+                        output.write(json.dumps(pending.popleft().result()) + "\n")
+                        answered += 1
+                while pending:
+                    output.write(json.dumps(pending.popleft().result()) + "\n")
+                    answered += 1
+        output.flush()
+        elapsed = time.perf_counter() - start_time
+        requests_per_sec = answered / elapsed if elapsed > 0 else float('inf')
+        print(f"Answered {answered} requests in {elapsed:.2f} s ({requests_per_sec:.0f} requests/sec).", file=sys.stderr)
+        return answered
+
+
+class DataExporter:
+    '''
+    Class for writing tables and report results to CSV or JSON-lines files. Takes a QueryExecutor as an argument.
+    Rows are fetched batch_size at a time and written as they arrive, so memory use does not depend on the size of the result.
+    Tables are written with ids, in the format DataImporter reads.
+    '''
+    def __init__(self, query_executor, reports=None, batch_size=10000):
+        self.query_executor = query_executor
+        self.reports = reports if reports is not None else UniversityReports(query_executor, batch_size=batch_size)
+        self.batch_size = batch_size
+
+    def export_table(self, table, output_file, file_format):
+        if table not in TABLE_COLUMNS:
+            raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLE_COLUMNS)}.")
+        columns = TABLE_COLUMNS[table]
+        rows = self.query_executor.iter_query(f"export_{table}", f"SELECT {', '.join(columns)} FROM {table} ORDER BY id",
+                                              None, self.batch_size)
+        return write_records(rows, columns, output_file, file_format)
+
+    def export_report(self, question, parameters, output_file, file_format):
+        rows = self.reports.answer(question, parameters, stream=True)
+        return write_records(rows, self.reports.ROW_TYPES[question]._fields, output_file, file_format)
 
 
 class QuestionSelector:
@@ -330,17 +2014,134 @@ class QuestionSelector:
                 print()
 
 
-def main():
-    db_filename = "university.db"
-
-    if not os.path.exists(db_filename):
-        db_initializer = DatabaseInitializer(db_filename)
-        db_initializer.initialize_database()
+def prepare_database(db_filename, output=sys.stdout, snapshot=None):
+    if os.path.exists(db_filename):
+        print("The database exists.", file=output)
+    elif snapshot is not None:
+        DatabaseSnapshot(snapshot).restore(db_filename)
+        print(f"Restored the database from {snapshot}.", file=output)
     else:
-        print("The database exists.")
+        db_initializer = DatabaseInitializer(db_filename)
+        db_initializer.initialize_database(bulk=True, output=output)
+        return
+    with CreateConnection(db_filename) as connection:
+        for version, description in SchemaMigrator(connection).migrate():
+            print(f"Applied migration {version}: {description}.", file=output)
+
+
+def run_batch(db_filename, input_path, workers, stream=False, slow_ms=None, stats_path=None, snapshot=None):
+    prepare_database(db_filename, output=sys.stderr, snapshot=snapshot)
+    instrumentation = None
+    if slow_ms is not None or stats_path is not None:
+        instrumentation = QueryInstrumentation(slow_ms / 1000 if slow_ms is not None else None)
+    with QueryExecutor(db_filename, pool_size=workers, instrumentation=instrumentation) as query_executor:
+        query_executor.preload_queries([f"query_{i}.sql" for i in range(1, 11)])
+        runner = BatchReportRunner(UniversityReports(query_executor), workers, stream)
+        if input_path == '-':
+            runner.run(sys.stdin, sys.stdout)
+        else:
+            with open(input_path, 'r') as input_file:
+                runner.run(input_file, sys.stdout)
+    if stats_path is not None:
+        with open(stats_path, 'w') as stats_file:
+            json.dump(instrumentation.export(), stats_file, indent=2)
+
+
+def run_rollover(db_filename, before, archive_dir, vacuum=True, snapshot=None):
+    prepare_database(db_filename, snapshot=snapshot)
+    with CreateConnection(db_filename) as connection:
+        archived = GradeArchiver(connection, archive_dir).rollover(before, vacuum)
+    for period, moved in archived:
+        print(f"Archived {moved} grades of {period} into {archive_dir}.")
+    if not archived:
+        print(f"No grades dated before {before}.")
+
+
+def run_import(db_filename, table, input_path, file_format=None, batch_size=10000, rows_per_transaction=100000):
+    # A missing database is created empty, so real data can be loaded without generated data next to it.
+    with CreateConnection(db_filename) as connection:
+        CreateTables(connection).create_tables()
+        SchemaMigrator(connection).migrate()
+        importer = DataImporter(connection, batch_size, rows_per_transaction)
+        with open_data_file(input_path, 'r') as input_file:
+            importer.import_file(table, input_file, data_file_format(input_path, file_format))
+
+
+def run_export(db_filename, source, output_path, parameters=None, file_format=None, snapshot=None):
+    prepare_database(db_filename, output=sys.stderr, snapshot=snapshot)
+    file_format = data_file_format(output_path, file_format)
+    with QueryExecutor(db_filename, pool_size=1, cache_max_bytes=0) as query_executor:
+        exporter = DataExporter(query_executor)
+        with open_data_file(output_path, 'w') as output_file:
+            if source in TABLE_COLUMNS:
+                written = exporter.export_table(source, output_file, file_format)
+            else:
+                written = exporter.export_report(int(source), parameters, output_file, file_format)
+    print(f"Exported {written} rows of {source}.", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask report questions about the university database.")
+    parser.add_argument('--db', default="university.db", help="database file (created with fake data if missing)")
+    parser.add_argument('--snapshot', help="snapshot to restore the database from if it is missing, instead of generating data")
+    subparsers = parser.add_subparsers(dest='command')
+    batch_parser = subparsers.add_parser('batch', help="answer JSON-lines requests and write JSON-lines results to stdout")
+    batch_parser.add_argument('input', nargs='?', default='-', help="requests file, - for stdin")
+    batch_parser.add_argument('--workers', type=int, default=4, help="number of concurrent readers")
+    batch_parser.add_argument('--stream', action='store_true', help="answer one request at a time, streaming its rows")
+    batch_parser.add_argument('--slow-ms', type=float, help="log queries slower than this with their query plan")
+    batch_parser.add_argument('--stats', help="file to write the per-query statistics to as JSON")
+    rollover_parser = subparsers.add_parser('rollover', help="move the grades dated before a day into yearly archive files")
+    rollover_parser.add_argument('--before', required=True, help="first day (YYYY-MM-DD) that stays in the database")
+    rollover_parser.add_argument('--archive-dir', default="archive", help="directory of the archive files")
+    rollover_parser.add_argument('--no-vacuum', action='store_true', help="do not shrink the database file afterwards")
+    snapshot_parser = subparsers.add_parser('snapshot', help="save the database as a snapshot to initialize others from")
+    snapshot_parser.add_argument('output', help="snapshot file, gzip-compressed if it ends in .gz")
+    import_parser = subparsers.add_parser('import', help="load a table from a CSV or JSON-lines file")
+    import_parser.add_argument('table', choices=TABLE_COLUMNS)
+    import_parser.add_argument('input', help="CSV file with a header line or JSON-lines file, - for stdin")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help="file format (by default from the file extension)")
+    import_parser.add_argument('--batch-size', type=int, default=10000, help="rows inserted and validated at a time")
+    import_parser.add_argument('--rows-per-transaction', type=int, default=100000, help="rows committed at a time")
+    export_parser = subparsers.add_parser('export', help="write a table or the answer to a question to a CSV or JSON-lines file")
+    export_parser.add_argument('source', help="table name or question number (1-10)")
+    export_parser.add_argument('output', help="CSV or JSON-lines file, - for stdout")
+    export_parser.add_argument('--parameters', type=json.loads, help='question parameters as JSON, e.g. \'{"subject": "Physics"}\'')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], help="file format (by default from the file extension)")
+    args = parser.parse_args()
+
+    db_filename = args.db
+    if args.command == 'batch':
+        run_batch(db_filename, args.input, args.workers, args.stream, args.slow_ms, args.stats, args.snapshot)
+        return
+    if args.command == 'rollover':
+        run_rollover(db_filename, args.before, args.archive_dir, not args.no_vacuum, args.snapshot)
+        return
+    if args.command == 'import':
+        try:
+            run_import(db_filename, args.table, args.input, args.format, args.batch_size, args.rows_per_transaction)
+        except ValueError as error:
+            sys.exit(f"Import failed: {error}")
+        return
+    if args.command == 'export':
+        try:
+            run_export(db_filename, args.source, args.output, args.parameters, args.format, args.snapshot)
+        except (LookupError, TypeError, ValueError) as error:
+            sys.exit(f"Export failed: {error}")
+        return
+    if args.command == 'snapshot':
+        prepare_database(db_filename, snapshot=args.snapshot)
+        DatabaseSnapshot(args.output).save(db_filename)
+        print(f"Saved a snapshot of {db_filename} to {args.output}.")
+        return
+
+    prepare_database(db_filename, snapshot=args.snapshot)
     print()
 
-    query_executor = QueryExecutor("university.db")
+    query_executor = QueryExecutor(db_filename)
+    query_executor.preload_queries([f"query_{i}.sql" for i in range(1, 11)])
+    reports = UniversityReports(query_executor)
+    names = reports.names
     while True:
         question_number = QuestionSelector.choose_question()
         
@@ -348,145 +2149,134 @@ def main():
             break
 
         elif question_number == 1:
-            query_result = query_executor.execute_sql_query("query_1.sql")
-            query_result.sort(key=lambda x: x[2], reverse=True)
             print("Below is a list of the 5 people with the highest average:")
-            for i, row in enumerate(query_result[:5], 1):
-                print(f"{i}. {row[1]} average {row[2]}")
+            for student in reports.top_students():
+                print(f"{student.position}. {student.name} average {student.average_grade}")
             print()
 
         elif question_number == 2:
             subject = input("Enter the name of the course subject (Mathematics, Physics, Chemistry, Biology, History, English): ")
-            if not query_executor.check_subject_exists(subject):
+            if not names.exists('subject', subject):
                 print("There is no such subject. Back to question selection.")
                 print()
                 continue
-            query_result = query_executor.execute_sql_query("query_2.sql", (subject,))
-            best_student = max(query_result, key=lambda x: x[2])
-            print(f"{best_student[1]} has the highest average in {subject} and it is {best_student[2]}")
+            for best_student in reports.best_students_in_subject(subject):
+                print(f"{best_student.name} has the highest average in {subject} and it is {best_student.average_grade}")
             print()
 
         elif question_number == 3:
             subject = input("Enter the name of the course subject (Mathematics, Physics, Chemistry, Biology, History, English): ")
-            if not query_executor.check_subject_exists(subject):
+            if not names.exists('subject', subject):
                 print("There is no such subject. Back to question selection.")
                 print()
                 continue
-            query_result = query_executor.execute_sql_query("query_3.sql", (subject,))
             print(f"Average grade for the subject {subject}:")
-            for row in query_result:
-                print(f"{row[1]} average {row[2]}")
+            for group in reports.group_averages_in_subject(subject):
+                print(f"{group.name} average {group.average_grade}")
             print()
 
         elif question_number == 4:
-            query_result = query_executor.execute_sql_query("query_4.sql")
             print("Average grade in all subjects:")
-            for row in query_result:
-                print(f"{row[1]} average {row[2]}")
+            for group in reports.group_averages():
+                print(f"{group.name} average {group.average_grade}")
             print()
 
         elif question_number == 5:
             lecturer = input("Enter the lecturer's name (university.db file): ")
-            if not query_executor.check_lecturer_exists(lecturer):
+            if not names.exists('lecturer', lecturer):
                 print("There is no such lecturer. Back to question selection.")
                 print()
                 continue
-            query_result = query_executor.execute_sql_query("query_5.sql", (lecturer,))
             print(f"Lecturer {lecturer} teaches the following subjects:")
-            for i, row in enumerate(query_result, start=1):
-                print(f"{i}. {row[1]}")
+            for i, subject in enumerate(reports.lecturer_subjects(lecturer), start=1):
+                print(f"{i}. {subject.name}")
             print()
 
         elif question_number == 6:
             group = input("Enter a group name (Group A, Group B, Group C): ")
-            if not query_executor.check_group_exists(group):
+            if not names.exists('group', group):
                 print("There is no such group. Back to question selection.")
                 print()
                 continue
-            query_result = query_executor.execute_sql_query("query_6.sql", (group,))
             print(f"List of people in the {group}:")
-            for i, row in enumerate(query_result, start=1):
-                print(f"{i}. {row[1]}")
+            for i, student in enumerate(reports.group_students(group, stream=True), start=1):
+                print(f"{i}. {student.name}")
             print()
 
         elif question_number == 7:
             group = input("Enter a group name (Group A, Group B, Group C): ")
-            if not query_executor.check_group_exists(group):
+            if not names.exists('group', group):
                 print("There is no such group. Back to question selection.")
                 print()
                 continue
             subject = input("Enter the name of the course subject (Mathematics, Physics, Chemistry, Biology, History, English): ")
-            if not query_executor.check_subject_exists(subject):
+            if not names.exists('subject', subject):
                 print("There is no such subject. Back to question selection.")
                 print()
                 continue
-            query_result = query_executor.execute_sql_query("query_7.sql", (group, subject))
             print()
             print(f"For {group} in {subject}, students obtained the following grades:")
-            students_grades = {}
-            for row in query_result:
-                student_name = row[1]
-                grade = row[2]
-                if student_name in students_grades:
-                    students_grades[student_name].append(grade)
-                else:
-                    students_grades[student_name] = [grade]
-            for student, grades in students_grades.items():
-                grades_str = ", ".join(map(str, grades))
-                print(f"{student}: {grades_str}")
+            for student in reports.group_subject_grades(group, subject, stream=True):
+                grades_str = ", ".join(map(str, student.grades))
+                print(f"{student.name}: {grades_str}")
             print()
 
         elif question_number == 8:
             lecturer_name = input("Enter the lecturer's name and surname (university.db file): ")
-            if not query_executor.check_lecturer_exists(lecturer_name):
+            if not names.exists('lecturer', lecturer_name):
                 print("There is no such lecturer. Back to question selection.")
                 print()
                 continue
             subject = input("Enter the name of the course subject (Mathematics, Physics, Chemistry, Biology, History, English): ")
-            if not query_executor.check_subject_exists(subject):
+            if not names.exists('subject', subject):
                 print("There is no such subject. Back to question selection.")
                 print()
                 continue
-            if not query_executor.check_lecturer_teaches_subject(lecturer_name, subject):
-                print(f"Lecturer {lecturer_name} does not teach {subject}.\n")
+            try:
+                subject_averages = reports.lecturer_subject_averages(lecturer_name, subject)
+            except LookupError as error:
+                print(f"{error}\n")
                 continue
 
-            query_result = query_executor.execute_sql_query("query_8.sql", (lecturer_name, subject))
-            if not query_result:
+            if not subject_averages:
                 print(f"No data for the lecturer {lecturer_name} and the subject {subject}.\n")
             else:
-                for row in query_result:
-                    print(f"The average grade given by {lecturer_name} for the subject {row[1]} is {row[2]}.")
+                for subject_average in subject_averages:
+                    print(f"The average grade given by {lecturer_name} for the subject {subject_average.name} is {subject_average.average_grade}.")
                 print()
 
         elif question_number == 9:
             student = input("Enter the student name (university.db file): ")
-            if not query_executor.check_student_exists(student):
+            try:
+                subjects = reports.student_subjects(student)
+            except LookupError:
                 print("There is no such student. Back to question selection.\n")
                 continue
-            query_result = query_executor.execute_sql_query("query_9.sql", (student,))
             print(f"Student {student} attends the following subjects:")
-            for i, row in enumerate(query_result, start=1):
-                print(f"{i}. {row[1]}")
+            for i, subject in enumerate(subjects, start=1):
+                print(f"{i}. {subject.name}")
             print()
 
         elif question_number == 10:
             lecturer = input("Enter the name of the lecturer (university.db file): ")
             print()
-            if not query_executor.check_lecturer_exists(lecturer):
+            if not names.exists('lecturer', lecturer):
                 print("There is no such lecturer. Back to question selection.\n")
                 continue
             student = input("Enter the student name (university.db file): ")
             print()
-            if not query_executor.check_student_exists(student):
+            try:
+                subjects = reports.lecturer_student_subjects(lecturer, student)
+            except LookupError:
                 print("There is no such student. Back to question selection.\n")
                 continue
-            query_result = query_executor.execute_sql_query("query_10.sql", (lecturer, student))
             print(f"List of subjects kept by {lecturer} for studenta {student}: ")
-            for i, row in enumerate(query_result, start=1):
-                print(f"{i}. {row[1]}")
+            for i, subject in enumerate(subjects, start=1):
+                print(f"{i}. {subject.name}")
             print()
 
+    query_executor.close()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
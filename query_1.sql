@@ -1,6 +1,20 @@
-SELECT students.id, students.name, AVG(grades.grade) as average_grade
-FROM students
-JOIN grades ON students.id = grades.student_id
-GROUP BY students.id, students.name
-ORDER BY average_grade DESC
-LIMIT 5;
+-- Only the students at or above the fifth best average are ranked and looked up, instead of windowing every student.
+SELECT RANK() OVER (ORDER BY totals.average_grade DESC) as position, students.id, students.name, totals.average_grade
+FROM (
+    SELECT student_id, CAST(grade_sum AS REAL) / grade_count as average_grade
+    FROM student_grade_totals
+    WHERE grade_count > 0
+) AS totals
+JOIN students ON students.id = totals.student_id
+WHERE totals.average_grade >= (
+    SELECT MIN(average_grade)
+    FROM (
+        SELECT CAST(student_grade_totals.grade_sum AS REAL) / student_grade_totals.grade_count as average_grade
+        FROM student_grade_totals
+        JOIN students ON students.id = student_grade_totals.student_id
+        WHERE student_grade_totals.grade_count > 0
+        ORDER BY average_grade DESC
+        LIMIT 5
+    )
+)
+ORDER BY position, students.id;
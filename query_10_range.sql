@@ -0,0 +1,7 @@
+SELECT subjects.id, subjects.name
+FROM subjects
+JOIN dated_grades ON subjects.id = dated_grades.subject_id
+JOIN students ON dated_grades.student_id = students.id
+WHERE subjects.lecturer_id IN (SELECT value FROM json_each(?1)) AND students.name = ?2
+AND dated_grades.day BETWEEN ?3 AND ?4
+GROUP BY subjects.id, subjects.name;
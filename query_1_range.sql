@@ -0,0 +1,22 @@
+-- Only the students at or above the fifth best average are ranked and looked up, instead of windowing every student.
+WITH totals AS (
+    SELECT student_id, AVG(grade) as average_grade
+    FROM dated_grades
+    WHERE day BETWEEN ?1 AND ?2
+    GROUP BY student_id
+    HAVING COUNT(grade) > 0
+)
+SELECT RANK() OVER (ORDER BY totals.average_grade DESC) as position, students.id, students.name, totals.average_grade
+FROM totals
+JOIN students ON students.id = totals.student_id
+WHERE totals.average_grade >= (
+    SELECT MIN(average_grade)
+    FROM (
+        SELECT totals.average_grade
+        FROM totals
+        JOIN students ON students.id = totals.student_id
+        ORDER BY totals.average_grade DESC
+        LIMIT 5
+    )
+)
+ORDER BY position, students.id;
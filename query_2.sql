@@ -1,8 +1,18 @@
-SELECT students.id, students.name, AVG(grades.grade) as average_grade
-FROM students
-JOIN grades ON students.id = grades.student_id
-JOIN subjects ON grades.subject_id = subjects.id
-WHERE subjects.name = ?
-GROUP BY students.id, students.name
-ORDER BY average_grade DESC
-LIMIT 1;
+-- The unary + keeps the planner on the subject_id primary key instead of scanning the student_id index for the grouping.
+-- Only the students with the best average are looked up, instead of ranking every student of the subject.
+WITH totals AS (
+    SELECT student_id, CAST(SUM(grade_sum) AS REAL) / SUM(grade_count) as average_grade
+    FROM student_subject_grade_totals
+    WHERE subject_id IN (SELECT value FROM json_each(?))
+    GROUP BY +student_id
+    HAVING SUM(grade_count) > 0
+)
+SELECT students.id, students.name, totals.average_grade
+FROM totals
+JOIN students ON students.id = totals.student_id
+WHERE totals.average_grade = (
+    SELECT MAX(totals.average_grade)
+    FROM totals
+    JOIN students ON students.id = totals.student_id
+)
+ORDER BY students.id;
@@ -0,0 +1,18 @@
+-- Only the students with the best average are looked up, instead of ranking every student of the subject.
+WITH totals AS (
+    SELECT student_id, AVG(grade) as average_grade
+    FROM dated_grades
+    WHERE day BETWEEN ?2 AND ?3
+    AND subject_id IN (SELECT value FROM json_each(?1))
+    GROUP BY student_id
+    HAVING COUNT(grade) > 0
+)
+SELECT students.id, students.name, totals.average_grade
+FROM totals
+JOIN students ON students.id = totals.student_id
+WHERE totals.average_grade = (
+    SELECT MAX(totals.average_grade)
+    FROM totals
+    JOIN students ON students.id = totals.student_id
+)
+ORDER BY students.id;
@@ -1,7 +1,6 @@
-SELECT groups.id, groups.name, AVG(grades.grade) as average_grade
-FROM groups
-JOIN students ON groups.id = students.group_id
-JOIN grades ON students.id = grades.student_id
-JOIN subjects ON grades.subject_id = subjects.id
-WHERE subjects.name = ?
-GROUP BY groups.id, groups.name;
+SELECT groups.id, groups.name, CAST(SUM(totals.grade_sum) AS REAL) / SUM(totals.grade_count) as average_grade
+FROM group_subject_grade_totals AS totals
+JOIN groups ON groups.id = totals.group_id
+WHERE totals.subject_id IN (SELECT value FROM json_each(?))
+GROUP BY groups.id, groups.name
+HAVING SUM(totals.grade_count) > 0;
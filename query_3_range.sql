@@ -0,0 +1,9 @@
+SELECT groups.id, groups.name, AVG(dated_grades.grade) as average_grade
+FROM dated_grades
+JOIN students ON students.id = dated_grades.student_id
+JOIN groups ON groups.id = students.group_id
+WHERE dated_grades.day BETWEEN ?2 AND ?3
+AND dated_grades.subject_id IN (SELECT value FROM json_each(?1))
+GROUP BY groups.id, groups.name
+HAVING COUNT(dated_grades.grade) > 0
+ORDER BY groups.id;
@@ -1,5 +1,4 @@
-SELECT groups.id, groups.name, AVG(grades.grade) as average_grade
-FROM groups
-JOIN students ON groups.id = students.group_id
-JOIN grades ON students.id = grades.student_id
-GROUP BY groups.id, groups.name;
+SELECT groups.id, groups.name, CAST(group_grade_totals.grade_sum AS REAL) / group_grade_totals.grade_count as average_grade
+FROM group_grade_totals
+JOIN groups ON groups.id = group_grade_totals.group_id
+WHERE group_grade_totals.grade_count > 0;
@@ -0,0 +1,8 @@
+SELECT groups.id, groups.name, AVG(dated_grades.grade) as average_grade
+FROM dated_grades
+JOIN students ON students.id = dated_grades.student_id
+JOIN groups ON groups.id = students.group_id
+WHERE dated_grades.day BETWEEN ?1 AND ?2
+GROUP BY groups.id, groups.name
+HAVING COUNT(dated_grades.grade) > 0
+ORDER BY groups.id;
@@ -1,4 +1,3 @@
 SELECT subjects.id, subjects.name
 FROM subjects
-JOIN lecturers ON subjects.lecturer_id = lecturers.id
-WHERE lecturers.name = ?;
+WHERE subjects.lecturer_id IN (SELECT value FROM json_each(?));
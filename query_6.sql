@@ -1,4 +1,3 @@
 SELECT students.id, students.name
 FROM students
-JOIN groups ON students.group_id = groups.id
-WHERE groups.name = ?;
+WHERE students.group_id IN (SELECT value FROM json_each(?));
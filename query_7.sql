@@ -1,6 +1,14 @@
-SELECT students.id, students.name, grades.grade, grades.date
-FROM students
-JOIN groups ON students.group_id = groups.id
-JOIN grades ON students.id = grades.student_id
-JOIN subjects ON grades.subject_id = subjects.id
-WHERE groups.name = ? AND subjects.name = ?;
+SELECT id, name, grades
+FROM (
+    SELECT students.id, students.name,
+           group_concat(grades.grade, ',') OVER student_grades as grades,
+           ROW_NUMBER() OVER student_grades as row_number
+    FROM students
+    JOIN grades ON students.id = grades.student_id
+    WHERE students.group_id IN (SELECT value FROM json_each(?1))
+    AND grades.subject_id IN (SELECT value FROM json_each(?2))
+    WINDOW student_grades AS (PARTITION BY students.id ORDER BY grades.id
+                              ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+)
+WHERE row_number = 1
+ORDER BY id;
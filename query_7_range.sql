@@ -0,0 +1,15 @@
+SELECT id, name, grades
+FROM (
+    SELECT students.id, students.name,
+           group_concat(dated_grades.grade, ',') OVER student_grades as grades,
+           ROW_NUMBER() OVER student_grades as row_number
+    FROM students
+    JOIN dated_grades ON students.id = dated_grades.student_id
+    WHERE students.group_id IN (SELECT value FROM json_each(?1))
+    AND dated_grades.subject_id IN (SELECT value FROM json_each(?2))
+    AND dated_grades.day BETWEEN ?3 AND ?4
+    WINDOW student_grades AS (PARTITION BY students.id ORDER BY dated_grades.id
+                              ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+)
+WHERE row_number = 1
+ORDER BY id;
@@ -1,6 +1,5 @@
-SELECT subjects.id, subjects.name, AVG(grades.grade) as average_grade
-FROM grades
-JOIN subjects ON grades.subject_id = subjects.id
-JOIN lecturers ON subjects.lecturer_id = lecturers.id
-WHERE lecturers.name = ? AND subjects.name = ?
-GROUP BY subjects.id, subjects.name;
+SELECT subjects.id, subjects.name, CAST(subject_grade_totals.grade_sum AS REAL) / subject_grade_totals.grade_count as average_grade
+FROM subject_grade_totals
+JOIN subjects ON subject_grade_totals.subject_id = subjects.id
+WHERE subjects.id IN (SELECT value FROM json_each(?))
+AND subject_grade_totals.grade_count > 0;
@@ -0,0 +1,7 @@
+SELECT subjects.id, subjects.name, AVG(dated_grades.grade) as average_grade
+FROM dated_grades
+JOIN subjects ON dated_grades.subject_id = subjects.id
+WHERE subjects.id IN (SELECT value FROM json_each(?1))
+AND dated_grades.day BETWEEN ?2 AND ?3
+GROUP BY subjects.id, subjects.name
+HAVING COUNT(dated_grades.grade) > 0;
@@ -0,0 +1,7 @@
+SELECT subjects.id, subjects.name
+FROM subjects
+JOIN dated_grades ON subjects.id = dated_grades.subject_id
+JOIN students ON dated_grades.student_id = students.id
+WHERE students.name = ?1
+AND dated_grades.day BETWEEN ?2 AND ?3
+GROUP BY subjects.id, subjects.name;
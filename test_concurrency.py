@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from database import (CreateConnection, DatabaseInitializer, FakeDataGenerator, InsertFakeData, QueryExecutor,
+                      UniversityReports)
+
+
+class ConcurrentReadWriteTest(unittest.TestCase):
+    '''
+    Readers on a QueryExecutor keep answering questions while a bulk load commits in chunks on the same database.
+    With WAL and busy_timeout none of them may fail with "database is locked".
+    '''
+    def setUp(self):
+        # The query files are opened by relative path.
+        self.previous_dir = os.getcwd()
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.temp_dir.name, "university.db")
+        DatabaseInitializer(self.db_name).initialize_database(bulk=True, generator=FakeDataGenerator(num_students=50, seed=1))
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        self.temp_dir.cleanup()
+
+    def test_readers_and_writer(self):
+        errors = []
+        reads = [0]
+        writing = threading.Event()
+        writing.set()
+
+        def read(query_executor):
+            reports = UniversityReports(query_executor)
+            try:
+                while writing.is_set():
+                    reports.top_students()
+                    reports.group_averages()
+                    query_executor.check_student_exists("Nobody")
+                    reads[0] += 1
+            except sqlite3.Error as error:
+                errors.append(error)
+
+        with QueryExecutor(self.db_name, pool_size=4, cache_max_bytes=0) as query_executor:
+            readers = [threading.Thread(target=read, args=(query_executor,)) for _ in range(4)]
+            for reader in readers:
+                reader.start()
+            try:
+                with CreateConnection(self.db_name) as connection:
+                    generator = FakeDataGenerator(num_students=2000, seed=2, batch_size=100)
+                    inserted = InsertFakeData(connection, generator).bulk_insert_all_data(rows_per_transaction=1000)
+            finally:
+                writing.clear()
+                for reader in readers:
+                    reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertGreater(inserted, 2000)
+        self.assertGreater(reads[0], 0)
+        with CreateConnection(self.db_name) as connection:
+            connection.cur.execute("SELECT COUNT(*) FROM students")
+            self.assertEqual(connection.cur.fetchone()[0], 2050)
+
+
+if __name__ == "__main__":
+    unittest.main()